@@ -0,0 +1,121 @@
+"""Compare direct DAC access against the cached, coalesced DAC layer.
+
+Plays the same per frame volts targets into a latency modelling SimDac
+ two ways. Directly, reading the DAC every frame and writing on change,
+ as the control loop once did. Then through an Actuator and CachedDac,
+ as Valve does now. Bursts of key presses give back to back writes.
+
+Frames are paced in real time at [fps], as a camera would, so only
+ writes queued within one frame can be coalesced. Loop time is the
+ time spent on the frames, waiting for the next one left out.
+
+Usage:
+    python -m benchmarks.dac [--frames N] [--fps N] [--latency S]
+                             [--rate N]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from src.actuator import Actuator
+from src.valve import CachedDac, SimDac
+
+
+def targets(frames, seed=0):
+    """Return volts targets for each frame (list of lists).
+
+    A drop every 60 frames sets new volts, every 300 frames
+     a burst of five '+' presses arrives within one frame.
+    """
+    rng = np.random.default_rng(seed)
+    volts = 1000
+    frames_targets = []
+    for frame in range(frames):
+        if frame % 60 == 0:
+            volts = int(1000 + rng.normal(0, 20))
+        if frame % 300 == 150:
+            frames_targets.append([volts + 8 * press for press in range(5)])
+            volts += 32
+        else:
+            frames_targets.append([volts])
+    return frames_targets
+
+
+def paced(frames_targets, fps, handle):
+    """Call handle(volts) for each frame's targets, one frame per 1/fps.
+
+    Returns: seconds spent in handle, waits between frames left out
+    """
+    busy = 0
+    start = time.perf_counter()
+    for frame, frame_targets in enumerate(frames_targets):
+        begun = time.perf_counter()
+        for volts in frame_targets:
+            handle(volts)
+        busy += time.perf_counter() - begun
+        remaining = start + (frame + 1) / fps - time.perf_counter()
+        if remaining > 0:
+            time.sleep(remaining)
+    return busy
+
+
+def direct(frames_targets, fps, dac):
+    """Read DAC every frame, write whenever the target differs.
+
+    Returns: seconds spent in the control loop
+    """
+    def handle(volts):
+        if dac.raw_value != volts:
+            dac.raw_value = volts
+
+    return paced(frames_targets, fps, handle)
+
+
+def cached(frames_targets, fps, dac, rate):
+    """Queue targets to an Actuator writing through a CachedDac.
+
+    Returns: (seconds spent in the control loop, CachedDac, Actuator)
+    """
+    bus = CachedDac(dac, rate)
+    actuator = Actuator(bus, time.sleep)
+
+    def handle(volts):
+        if actuator.target != volts:
+            actuator.set(volts)
+
+    elapsed = paced(frames_targets, fps, handle)
+    actuator.stop()
+    return elapsed, bus, actuator
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--frames', type=int, default=600)
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--latency', type=float, default=0.0005,
+                        help="seconds per simulated bus transaction")
+    parser.add_argument('--rate', type=float, default=100,
+                        help="most DAC writes per second when cached")
+    args = parser.parse_args()
+
+    frames_targets = targets(args.frames)
+
+    dac = SimDac(args.latency)
+    loop = direct(frames_targets, args.fps, dac)
+    print("Access\tReads\tWrites\tBus ms\tLoop ms\tCoalesced")
+    print("direct\t{}\t{}\t{:.1f}\t{:.1f}\t-".format(
+          dac.reads, dac.writes,
+          (dac.reads + dac.writes) * args.latency * 1000, loop * 1000))
+
+    dac = SimDac(args.latency)
+    loop, bus, actuator = cached(frames_targets, args.fps, dac,
+                                 args.rate)
+    print("cached\t{}\t{}\t{:.1f}\t{:.1f}\t{}".format(
+          dac.reads, dac.writes,
+          (dac.reads + dac.writes) * args.latency * 1000, loop * 1000,
+          actuator.coalesced))
+
+
+if __name__ == '__main__':
+    main()
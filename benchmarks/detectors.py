@@ -0,0 +1,54 @@
+"""Compare drop detectors for per-frame cost and drop agreement.
+
+Runs every detector in DETECTORS over the same recorded ROI crops,
+ picks out drops with Experiment's threshold rule and compares them
+ against MOG2's drops.
+
+Usage:
+    python -m benchmarks.detectors VIDEO [--roi W N E S] [--scale N]
+                                         [--channel C] [--frames N]
+"""
+import argparse
+
+import numpy as np
+
+from src.detector import DETECTORS
+
+from .scale import agreement, detect, load_rois, measure
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('video')
+    parser.add_argument('--roi', type=int, nargs=4,
+                        metavar=('WEST', 'NORTH', 'EAST', 'SOUTH'))
+    parser.add_argument('--scale', type=float, default=1)
+    parser.add_argument('--channel', type=int, choices=(0, 1, 2))
+    parser.add_argument('--frames', type=int, default=3000)
+    args = parser.parse_args()
+
+    rois, fps = load_rois(args.video, args.roi, args.frames)
+    print("{} frames of {}x{} at {:.1f} FPS\n".format(
+          len(rois), rois[0].shape[1], rois[0].shape[0], fps))
+
+    reference = None
+    print("Detector\tms/frame\tp95 ms\tNoise p50\tDrops\tRecall\tPrecision")
+    for name in DETECTORS:
+        noises, times = measure(rois, args.scale, args.channel, name)
+        drops = detect(noises, fps)
+        if reference is None:
+            reference = drops
+        recall, precision = agreement(reference, drops)
+        print("{}\t\t{:.3f}\t\t{:.3f}\t{:.0f}\t\t{}\t{:.3f}\t{:.3f}".format(
+              name,
+              times.mean() * 1000,
+              np.percentile(times, 95) * 1000,
+              np.median(noises),
+              len(drops),
+              recall,
+              precision,
+              ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""Compare drop detection and per-frame cost across ROI scales.
+
+Runs the Monitor detection path (prepare_roi + detector) over a recorded
+ video once per scale factor. Drops are picked out of the noise by a
+ Dripper, as in an experiment, and compared against full resolution
+ grayscale.
+
+Usage:
+    python -m benchmarks.scale VIDEO [--roi W N E S] [--scales 1 2 4]
+                                     [--channel C] [--detector D]
+                                     [--frames N]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from src.detector import DETECTORS, create_detector
+from src.monitor import count_moving, prepare_roi
+
+from .suite import dripper, quiet
+
+
+def load_rois(path, roi=None, frames=3000):
+    """Decode up to [frames] ROI crops of a video into memory.
+
+    Decoding is done up front so it is not counted in per-frame times.
+
+    Returns: (list of ROI crops, frames per second)
+    """
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise Exception("Unable to open {}".format(path))
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30
+
+    rois = []
+    while len(rois) < frames:
+        grabbed, frame = capture.read()
+        if not grabbed:
+            break
+        if roi:
+            west, north, east, south = roi
+            frame = frame[north: south, west: east]
+        rois.append(np.ascontiguousarray(frame))
+    capture.release()
+
+    return rois, fps
+
+
+def measure(rois, scale=1, channel=None, detector='mog2'):
+    """Run detection over every ROI crop at one scale.
+
+    Returns: (noise per frame, seconds per frame) as arrays
+    """
+    detector = create_detector(detector)
+    noises = np.empty(len(rois), dtype=np.int64)
+    times = np.empty(len(rois))
+
+    for index, roi in enumerate(rois):
+        start = time.perf_counter()
+        gray = prepare_roi(roi, scale, channel)
+        fg_mask = detector.apply(gray)
+        noises[index] = count_moving(fg_mask, roi.shape)
+        times[index] = time.perf_counter() - start
+
+    return noises, times
+
+
+def detect(noises, fps):
+    """Pick drop frames out of noise values with a Dripper.
+
+    Frames are fed to Dripper.control as an experiment would,
+     without masks, so blobs are not classified.
+    Its logs go to a temporary directory.
+
+    Returns: frame indices of detected drops (array)
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        drips = dripper(os.path.join(directory, 'scale'))
+        clock = drips.clock
+        with quiet():
+            for frame, noise in enumerate(noises.tolist()):
+                drips.frame_no = frame
+                drips.frame_time = frame / fps
+                clock.set(drips.frame_time)
+                drips.control(noise)
+            drips.actuator.shutoff()
+            drips.finish()
+
+    return np.array([drop[2] for drop in drips.drops], dtype=np.int64)
+
+
+def agreement(reference, drops, tolerance=2):
+    """Match drops against reference drops within [tolerance] frames.
+
+    Returns: (recall, precision) as fractions, 1.0 when nothing to match
+    """
+    if len(reference) == 0 or len(drops) == 0:
+        same = len(reference) == len(drops)
+        return float(same), float(same)
+
+    index = np.searchsorted(reference, drops).clip(1, len(reference) - 1)
+    nearest = np.minimum(abs(drops - reference[index - 1]),
+                         abs(drops - reference[index]))
+    matched = np.count_nonzero(nearest <= tolerance)
+
+    return (min(matched, len(reference)) / len(reference),
+            matched / len(drops))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('video')
+    parser.add_argument('--roi', type=int, nargs=4,
+                        metavar=('WEST', 'NORTH', 'EAST', 'SOUTH'))
+    parser.add_argument('--scales', type=float, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--channel', type=int, choices=(0, 1, 2))
+    parser.add_argument('--detector', choices=DETECTORS, default='mog2')
+    parser.add_argument('--frames', type=int, default=3000)
+    args = parser.parse_args()
+
+    rois, fps = load_rois(args.video, args.roi, args.frames)
+    print("{} frames of {}x{} at {:.1f} FPS\n".format(
+          len(rois), rois[0].shape[1], rois[0].shape[0], fps))
+
+    runs = [(1, None)] + [(scale, args.channel) for scale in args.scales
+                          if (scale, args.channel) != (1, None)]
+    reference = None
+    print("Scale\tChannel\tms/frame\tp95 ms\tDrops\tRecall\tPrecision")
+    for scale, channel in runs:
+        noises, times = measure(rois, scale, channel, args.detector)
+        drops = detect(noises, fps)
+        if reference is None:
+            reference = drops
+        recall, precision = agreement(reference, drops)
+        print("{:g}\t{}\t{:.3f}\t\t{:.3f}\t{}\t{:.3f}\t{:.3f}".format(
+              scale,
+              'gray' if channel is None else channel,
+              times.mean() * 1000,
+              np.percentile(times, 95) * 1000,
+              len(drops),
+              recall,
+              precision,
+              ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,347 @@
+"""Benchmark the Monitor, Model, Valve and log I/O hot paths offline.
+
+Everything runs on synthetic inputs from fixed seeds: drop videos of
+ blobs falling onto a rippling surface over a noisy background, at each
+ ROI size in SIZES, replayed through the full control loop on a SimDac.
+
+    monitor  frames per second and per stage cost of each video's replay
+    model    cost of Model.add_noise and Model.add_drop calls
+    valve    cost of per frame set_volts and per drop calculate calls
+    memory   Python heap growth per simulated hour of a Dripper's run
+    log      ExperimentLog write and analysis.read_log parse throughput
+
+Each benchmark is run [repeat] times and its best results kept,
+ so runs are less thrown by other load on the machine.
+Results can be saved as a baseline JSON file and later runs compared
+ against it. Any result more than [tolerance] worse than its baseline
+ is flagged, and the exit code is then 1.
+
+Usage:
+    python -m benchmarks.suite [--only NAME ...] [--repeat N]
+                               [--frames N] [--calls N] [--rows N]
+                               [--hours H] [--save FILE]
+                               [--baseline FILE] [--tolerance T]
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from src.analysis import read_log
+from src.clock import FrameClock
+from src.dripper import Dripper
+from src.log import ExperimentLog
+from src.model import Model
+from src.replay import replay
+from src.valve import SimDac
+
+SIZES = [(160, 120), (320, 240), (640, 480)]
+BENCHMARKS = ('monitor', 'model', 'valve', 'memory', 'log')
+FPS = 30
+PERIOD = 60
+
+
+def make_video(path, size, frames, seed=0):
+    """Write a synthetic drop video of [frames] frames of [size] (w, h).
+
+    After the first Dripper.CALIBRATION_FRAMES, calibrated on background
+     alone, a drop falls every PERIOD frames, leaving a flat ripple where
+     it lands. Drops are large enough to be detected at every size,
+     and fall within RIPPLE_DELAY, so each is detected once.
+    The background has fresh noise on every frame.
+
+    Returns: number of drops in the video (int)
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+    radius = max(2, height // 8)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), FPS,
+                             size)
+    for index in range(frames):
+        frame = np.full((height, width, 3), 60, np.uint8)
+        frame += rng.integers(0, 6, frame.shape, dtype=np.uint8)
+        step = index % PERIOD
+        if index < Dripper.CALIBRATION_FRAMES:
+            pass
+        elif step < 2:
+            cv2.circle(frame, (width // 2, radius + step * height // 2),
+                       radius, (255, 255, 255), -1)
+        elif step < 6:
+            cv2.ellipse(frame, (width // 2, height - radius),
+                        (radius * step, radius // 2), 0, 0, 360,
+                        (200, 200, 200), -1)
+        writer.write(frame)
+    writer.release()
+
+    first = -(-Dripper.CALIBRATION_FRAMES // PERIOD) * PERIOD
+    return len(range(first, frames, PERIOD))
+
+
+@contextlib.contextmanager
+def quiet():
+    """Discard everything printed within."""
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull):
+            yield
+
+
+def result(value, unit, better):
+    """Return one result, [better] being 'higher' or 'lower'."""
+    return {'value': value, 'unit': unit, 'better': better}
+
+
+def bench_monitor(frames):
+    """Replay a synthetic video of each size through Experiment.
+
+    Every drop of each video must be detected once,
+     so drop detection is timed too.
+
+    Returns: {name: result}
+    """
+    results = {}
+    for width, height in SIZES:
+        name = "monitor.{}x{}".format(width, height)
+        path = "video_{}x{}.avi".format(width, height)
+        drops = make_video(path, (width, height), frames)
+
+        start = time.perf_counter()
+        with quiet():
+            experiment = replay(path, name, volts=1000, profile=True)
+        elapsed = time.perf_counter() - start
+        assert len(experiment.drops) == drops, (
+            "{} drops detected in {}, {} expected".format(
+                len(experiment.drops), path, drops))
+
+        results[name + ".fps"] = result(experiment.capture_no / elapsed,
+                                        'frames/s', 'higher')
+        for stage in ('prepare', 'subtract', 'blobs', 'frame'):
+            histogram = experiment.profiler.stages[stage]
+            results["{}.{}".format(name, stage)] = result(
+                histogram.total / histogram.count * 1e6, 'us/call', 'lower')
+    return results
+
+
+def per_call(function, calls):
+    """Return microseconds per call of function(index) over [calls]."""
+    start = time.perf_counter()
+    for index in range(calls):
+        function(index)
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def bench_model(calls):
+    """Time Model.add_noise and Model.add_drop.
+
+    Returns: {name: result}
+    """
+    rng = np.random.default_rng(0)
+    noises = rng.poisson(100, calls).tolist()
+    with quiet():
+        model = Model(clock=FrameClock(0))
+    noise = per_call(lambda index: model.add_noise(index, noises[index]),
+                     calls)
+    drop = per_call(lambda index: model.add_drop(index, noises[index], 0,
+                                                 1000, index / FPS),
+                    calls)
+    model.drops.close()
+    return {'model.add_noise': result(noise, 'us/call', 'lower'),
+            'model.add_drop': result(drop, 'us/call', 'lower'),
+            }
+
+
+def dripper(title, volts=1000):
+    """Return a Dripper on a FrameClock and a SimDac without latency."""
+    with quiet():
+        return Dripper(title, clock=FrameClock(0), dac=SimDac(latency=0),
+                       dac_rate=0, volts=volts)
+
+
+def bench_valve(calls):
+    """Time the per frame set_volts and per drop calculate calls.
+
+    Returns: {name: result}
+    """
+    valve = dripper('valve')
+    with quiet():
+        frame = per_call(lambda index: valve.set_volts(0xFF), calls)
+        drop = per_call(lambda index: valve.calculate(50, 2,
+                                                      -1 - index % 3),
+                        calls // 10)
+        valve.actuator.shutoff()
+        valve.finish()
+    return {'valve.set_volts': result(frame, 'us/call', 'lower'),
+            'valve.calculate': result(drop, 'us/call', 'lower'),
+            }
+
+
+def bench_memory(hours):
+    """Run a Dripper over [hours] of synthetic noise at FPS.
+
+    Heap use is taken after the first hour, once calibration and
+     buffers have settled, and again at the end, so at least
+     two hours are run.
+
+    Returns: {name: result}
+    """
+    hours = max(2, hours)
+    rng = np.random.default_rng(0)
+    frames_per_hour = 3600 * FPS
+    drips = dripper('memory')
+    clock = drips.clock
+
+    tracemalloc.start()
+    with quiet():
+        for hour in range(hours):
+            noises = rng.poisson(100, frames_per_hour)
+            noises[::PERIOD] += 2000
+            for noise in noises.tolist():
+                drips.frame_no += 1
+                drips.frame_time = drips.frame_no / FPS
+                clock.set(drips.frame_time)
+                drips.control(noise)
+            if hour == 0:
+                settled = tracemalloc.get_traced_memory()[0]
+        current, peak = tracemalloc.get_traced_memory()
+        drips.actuator.shutoff()
+        drips.finish()
+    tracemalloc.stop()
+
+    growth = (current - settled) / (hours - 1)
+    return {'memory.growth': result(growth / 1024, 'KiB/hour', 'lower'),
+            'memory.peak': result(peak / 1024 ** 2, 'MiB', 'lower'),
+            }
+
+
+def bench_log(rows):
+    """Write [rows] noise and rows/10 drop rows, then parse them back.
+
+    Returns: {name: result}
+    """
+    log = ExperimentLog('log', "TotalTime\tTimeSinceDrop\tFrame"
+                        "\tMovingPixelAvg\tMovingPixels\tVoltage\n")
+    start = time.perf_counter()
+    for row in range(rows):
+        log.noise((row, row % 200))
+        if row % 10 == 0:
+            log.drop((row / FPS, 2.0, row, 100.5, 2000, 1000))
+    log.close("Tank emptied: Succesful\n")
+    write = time.perf_counter() - start
+
+    size = os.path.getsize('log.txt') + os.path.getsize('log_Noise.txt')
+    start = time.perf_counter()
+    parsed = read_log('log.txt')
+    parse = time.perf_counter() - start
+    assert len(parsed['noise']['frame']) == rows
+
+    return {'log.write': result(rows * 1.1 / write, 'rows/s', 'higher'),
+            'log.parse': result(size / parse / 1024 ** 2, 'MiB/s',
+                                'higher'),
+            }
+
+
+def best(results, now):
+    """Return the better of two results for the same benchmark."""
+    if results is None:
+        return now
+    if now['better'] == 'higher':
+        return now if now['value'] > results['value'] else results
+    return now if now['value'] < results['value'] else results
+
+
+def compare(results, baseline, tolerance):
+    """Print results next to their baseline.
+
+    Returns: names of results over [tolerance] worse than baseline
+    """
+    regressions = []
+    print("Benchmark\t\t\tBaseline\tNow\t\tChange")
+    for name, now in results.items():
+        if name not in baseline:
+            print("{:<24}\t-\t\t{:.4g}\t\tnew".format(name, now['value']))
+            continue
+        before = baseline[name]['value']
+        change = (now['value'] - before) / before if before else 0
+        worse = -change if now['better'] == 'higher' else change
+        flag = ""
+        if worse > tolerance:
+            regressions.append(name)
+            flag = " REGRESSION"
+        print("{:<24}\t{:.4g}\t\t{:.4g}\t\t{:+.1%}{}".format(
+              name, before, now['value'], change, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS,
+                        default=BENCHMARKS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--frames', type=int, default=600,
+                        help="frames of each synthetic video")
+    parser.add_argument('--calls', type=int, default=100000)
+    parser.add_argument('--hours', type=int, default=2,
+                        help="hours of simulated run for memory growth")
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--save', metavar='FILE',
+                        help="save results as a baseline")
+    parser.add_argument('--baseline', metavar='FILE',
+                        help="compare results with a saved baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="fraction worse than baseline to flag")
+    args = parser.parse_args()
+
+    save = os.path.abspath(args.save) if args.save else None
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+
+    runs = {'monitor': lambda: bench_monitor(args.frames),
+            'model': lambda: bench_model(args.calls),
+            'valve': lambda: bench_valve(args.calls),
+            'memory': lambda: bench_memory(args.hours),
+            'log': lambda: bench_log(args.rows),
+            }
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            for name in args.only:
+                print("Running {}...".format(name), file=sys.stderr)
+                for __ in range(args.repeat):
+                    for key, now in runs[name]().items():
+                        results[key] = best(results.get(key), now)
+        finally:
+            os.chdir(cwd)
+
+    regressions = []
+    if baseline:
+        regressions = compare(results, baseline, args.tolerance)
+    else:
+        for name, now in results.items():
+            print("{:<24}\t{:.4g} {}".format(name, now['value'], now['unit']))
+
+    if save:
+        with open(save, 'w') as save_file:
+            json.dump({'python': sys.version.split()[0],
+                       'numpy': np.__version__,
+                       'opencv': cv2.__version__,
+                       'results': results,
+                       }, save_file, indent=1)
+        print("Saved to {}".format(save))
+    if regressions:
+        print("{} of {} benchmarks regressed.".format(len(regressions),
+                                                      len(results)))
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+import queue
+import threading
+import time
+
+
+class Actuator():
+    """Valve Actuator Thread.
+
+    Owns the DAC and performs every write to it on a dedicated thread.
+    The control loop only queues target voltages and ramps,
+     so slow ramps never hold up frame processing.
+
+    A new command cuts short any ramp still in progress,
+     the valve then heads straight for the newest target.
+    Immediate writes queued back to back are combined into the newest,
+     counted in coalesced. Before combining, the actuator waits until
+     the DAC allows another write, if it has a wait() method.
+
+    A write may carry the time.monotonic() stamp of the frame it reacts
+     to. If profiling, time from that stamp to the write is recorded
+     as 'drop_latency'. Combined writes keep the oldest stamp.
+    """
+
+    def __init__(self, dac, sleep, profiler=None):
+        """Start actuator thread for [dac].
+
+        sleep: waits between ramp steps, e.g. a Clock's sleep.
+        profiler: if given, DAC writes are timed as 'dac_write',
+         stamped writes also as 'drop_latency'.
+        """
+        self.dac = dac
+        self.value = dac.raw_value
+        self.target = self.value
+        self.coalesced = 0
+
+        self.__sleep = sleep
+        self.__profiler = profiler
+        self.__queue = queue.SimpleQueue()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def set(self, volts, stamp=None):
+        """Queue an immediate write of [volts], stamped with [stamp]."""
+        self.target = volts
+        self.__queue.put((volts, 0, 0, stamp))
+
+    def ramp(self, volts, step, interval):
+        """Queue a ramp to [volts] by [step] every [interval] seconds."""
+        self.target = volts
+        self.__queue.put((volts, step, interval, None))
+
+    def shutoff(self):
+        """Queue complete valve closure.
+
+        Makes the current volts a multiple of 10. Then decreases by 5
+         every 0.1s until the volts are 20, below calibrated 'closed'.
+        """
+        self.target = 20
+        self.__queue.put((None, 0, 0, None))
+
+    def stop(self):
+        """Finish queued commands, then stop the thread."""
+        self.__queue.put(False)
+        self.__thread.join()
+
+    def __run(self):
+        """Execute commands in order until stopped."""
+        wait = getattr(self.dac, 'wait', None)
+        command = None
+        while True:
+            if command is None:
+                command = self.__queue.get()
+            if command is False:
+                break
+
+            following = None
+            if command[0] is not None and not command[1]:
+                if wait:
+                    wait()
+                command, following = self.__coalesce(command)
+
+            volts, step, interval, stamp = command
+            command = following
+            if volts is None:
+                print("Shutting off valve...")
+                self.__write(int(self.value / 10) * 10)
+                if self.value > 20:
+                    self.__ramp(20, 5, 0.1, preempt=False)
+                print("Valve closed.\n")
+            elif step:
+                self.__ramp(volts, step, interval)
+            else:
+                self.__write(volts, stamp)
+
+    def __coalesce(self, command):
+        """Skip to the newest of immediate writes queued after [command].
+
+        Returns: (command to run, next queued command or None)
+        """
+        while True:
+            try:
+                following = self.__queue.get_nowait()
+            except queue.Empty:
+                return command, None
+            if following is False or following[0] is None or following[1]:
+                return command, following
+            stamp = following[3] if command[3] is None else command[3]
+            command = following[:3] + (stamp,)
+            self.coalesced += 1
+
+    def __ramp(self, volts, step, interval, preempt=True):
+        """Step towards [volts]. Give up early if a new command arrives."""
+        while self.value != volts:
+            if preempt and not self.__queue.empty():
+                return
+            if abs(volts - self.value) <= step:
+                self.__write(volts)
+            elif volts > self.value:
+                self.__write(self.value + step)
+            else:
+                self.__write(self.value - step)
+            self.__sleep(interval)
+
+    def __write(self, volts, stamp=None):
+        """Write [volts] to the DAC."""
+        profiler = self.__profiler
+        if profiler:
+            mark = profiler.start()
+        self.dac.raw_value = volts
+        self.value = volts
+        if profiler:
+            profiler.stop('dac_write', mark)
+            if stamp is not None:
+                profiler.record('drop_latency', time.monotonic() - stamp)
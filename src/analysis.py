@@ -0,0 +1,214 @@
+"""Batch analysis of experiment logs.
+
+Reads the drop logs written by Experiment (<title>_<date>.txt) and their
+ _Noise.txt companions into columnar numpy arrays, parsing each block of
+ rows in one call rather than line by line. A whole directory is read by
+ a process pool and summarised per run and per viscosity.
+
+Usage:
+    python -m src.analysis DIRECTORY [--workers N] [--csv FILE]
+"""
+import argparse
+import concurrent.futures
+import glob
+import os
+
+import numpy as np
+
+DROP_COLUMNS = ('time',
+                'time_since_drop',
+                'frame',
+                'noise_average',
+                'noise',
+                'volts',
+                )
+NOISE_COLUMNS = ('frame', 'noise')
+NOISE_BINS = np.concatenate(([0], np.logspace(0, 6, 121)))
+SETTLED = 0.05
+
+
+def parse_rows(text, columns):
+    """Parse whitespace separated numbers into one array per column.
+
+    A partly written last row, e.g. after a crash, is dropped.
+
+    Returns: {column name: array}
+    """
+    values = np.fromstring(text, dtype=float, sep=' ')
+    rows = values[:len(values) - len(values) % len(columns)]
+    rows = rows.reshape(-1, len(columns))
+    return {name: rows[:, index] for index, name in enumerate(columns)}
+
+
+def parse_fields(lines):
+    """Parse 'Key: value' lines into a dict, numbers as floats."""
+    fields = {}
+    for line in lines:
+        key, colon, value = line.strip().partition(': ')
+        if colon:
+            try:
+                fields[key] = float(value)
+            except ValueError:
+                fields[key] = value
+    return fields
+
+
+def read_log(path, noise=True):
+    """Read a drop log, and its noise log if present and [noise].
+
+    Returns: {'header': {...}, 'drops': {column: array},
+              'footer': {...}, 'notes': [...], 'noise': {column: array}}
+    """
+    with open(path) as log:
+        text = log.read()
+
+    columns = text.find('TotalTime')
+    start = text.find('\n', columns) + 1 if columns >= 0 else len(text)
+    end = text.find('Tank emptied:', start)
+    end = len(text) if end < 0 else end
+
+    footer = text[end:].split('\n')
+    notes = [line.strip() for line in footer
+             if line.strip().startswith(('Notes at frame', 'Final Notes'))]
+
+    log = {'header': parse_fields(text[:columns].split('\n')),
+           'drops': parse_rows(text[start:end], DROP_COLUMNS),
+           'footer': parse_fields(footer),
+           'notes': notes,
+           'noise': None,
+           }
+
+    noise_path = path[:-len('.txt')] + '_Noise.txt'
+    if noise and os.path.exists(noise_path):
+        with open(noise_path) as noise:
+            log['noise'] = parse_rows(noise.read(), NOISE_COLUMNS)
+
+    return log
+
+
+def summarize(path):
+    """Reduce one run to its key figures.
+
+    Volts convergence is measured against the median volts
+     of the last fifth of drops. The run settled at the first drop
+     after which volts stay within SETTLED of that median.
+    Noise comes from the noise log if present, else drop log averages.
+
+    Returns: dict of figures, with the noise histogram over NOISE_BINS
+    """
+    log = read_log(path)
+    header, drops = log['header'], log['drops']
+    times, volts = drops['time'], drops['volts']
+
+    summary = {'run': os.path.basename(path)[:-len('.txt')],
+               'viscosity': header.get('Viscosity', np.nan),
+               'spd': header.get('Seconds per drop', np.nan),
+               'drops': len(times),
+               'minutes': times[-1] / 60 if len(times) else 0,
+               'drops_per_min': np.nan,
+               'spd_actual': np.nan,
+               'final_volts': log['footer'].get('Final voltage', np.nan),
+               'settled_volts': np.nan,
+               'settled_at': np.nan,
+               'volts_spread': np.nan,
+               'completed': log['footer'].get('Tank emptied') == 'Succesful',
+               }
+
+    if len(times) > 1:
+        duration = times[-1] - times[0]
+        summary['drops_per_min'] = (len(times) - 1) / duration * 60
+        summary['spd_actual'] = np.median(drops['time_since_drop'][1:])
+
+    if len(volts):
+        tail = volts[-max(1, len(volts) // 5):]
+        settled = np.median(tail)
+        outside = np.abs(volts - settled) > SETTLED * max(settled, 1)
+        last = np.flatnonzero(outside)
+        index = last[-1] + 1 if len(last) else 0
+        summary['settled_volts'] = settled
+        summary['volts_spread'] = np.std(tail) / max(settled, 1)
+        if index < len(times):
+            summary['settled_at'] = times[index]
+
+    noise = log['noise']['noise'] if log['noise'] else drops['noise_average']
+    summary['histogram'] = np.histogram(noise, NOISE_BINS)[0]
+
+    return summary
+
+
+def percentile(histogram, percent):
+    """Return [percent]th percentile of a histogram over NOISE_BINS."""
+    counts = np.cumsum(histogram)
+    if counts[-1] == 0:
+        return np.nan
+    index = np.searchsorted(counts, counts[-1] * percent / 100)
+    return NOISE_BINS[index + 1]
+
+
+def analyze(directory, workers=None):
+    """Summarise every drop log in [directory] with a process pool.
+
+    Returns: (list of run summaries, {viscosity: aggregate figures})
+    """
+    paths = sorted(path for path in glob.glob(os.path.join(directory, '*.txt'))
+                   if not path.endswith('_Noise.txt'))
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        runs = list(pool.map(summarize, paths, chunksize=4))
+
+    viscosities = {}
+    for viscosity in sorted(set(run['viscosity'] for run in runs)):
+        group = [run for run in runs if run['viscosity'] == viscosity]
+        histogram = np.sum([run['histogram'] for run in group], axis=0)
+        viscosities[viscosity] = {
+            'runs': len(group),
+            'drops': sum(run['drops'] for run in group),
+            'drops_per_min': np.nanmean([run['drops_per_min']
+                                         for run in group]),
+            'settled_volts': np.nanmean([run['settled_volts']
+                                         for run in group]),
+            'settled_at': np.nanmean([run['settled_at'] for run in group]),
+            'noise_p50': percentile(histogram, 50),
+            'noise_p90': percentile(histogram, 90),
+            'noise_p99': percentile(histogram, 99),
+            }
+
+    return runs, viscosities
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directory')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--csv', help="also write run summaries to this file")
+    args = parser.parse_args()
+
+    runs, viscosities = analyze(args.directory, args.workers)
+
+    columns = ('run', 'viscosity', 'spd', 'drops', 'minutes',
+               'drops_per_min', 'spd_actual', 'final_volts',
+               'settled_volts', 'settled_at', 'volts_spread')
+    lines = ['\t'.join(columns)]
+    for run in runs:
+        lines.append('\t'.join(str(run[column]) if isinstance(run[column], str)
+                               else '{:.4g}'.format(run[column])
+                               for column in columns))
+    print('\n'.join(lines))
+    if args.csv:
+        with open(args.csv, 'w') as csv:
+            csv.write('\n'.join(line.replace('\t', ',') for line in lines))
+            csv.write('\n')
+
+    print("\nViscosity\tRuns\tDrops\tDrops/min\tVolts\tSettled s"
+          "\tNoise p50\tp90\tp99")
+    for viscosity, group in viscosities.items():
+        print("{:g}\t\t{}\t{}\t{:.2f}\t\t{:.0f}\t{:.0f}\t\t{:.3g}\t\t{:.3g}"
+              "\t{:.3g}".format(viscosity, group['runs'], group['drops'],
+                                group['drops_per_min'],
+                                group['settled_volts'], group['settled_at'],
+                                group['noise_p50'], group['noise_p90'],
+                                group['noise_p99']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+import cv2
+import numpy as np
+
+MIN_AREA = 4
+STREAM_SPAN = 0.6
+STREAM_ASPECT = 2
+RIPPLE_ASPECT = 2
+
+
+def analyze(fg_mask, shape, min_area=MIN_AREA):
+    """Find the blobs of moving pixels in a foreground mask.
+
+    Blobs are 8-connected components, found and measured in one
+     OpenCV pass, then handled as whole arrays.
+    Sizes are scaled to full resolution pixels, so a mask made
+     from a downscaled ROI measures the same as a full one.
+    Blobs under [min_area] pixels are dropped as noise.
+
+    shape: shape of the full resolution ROI the mask was made from.
+
+    Returns: {'area', 'height', 'width'} arrays, one element per blob
+    """
+    __, __, stats, __ = cv2.connectedComponentsWithStats(fg_mask,
+                                                         connectivity=8)
+    stats = stats[1:]
+    y_scale = shape[0] / fg_mask.shape[0]
+    x_scale = shape[1] / fg_mask.shape[1]
+
+    area = stats[:, cv2.CC_STAT_AREA] * (y_scale * x_scale)
+    keep = area >= min_area
+    return {'area': area[keep],
+            'height': stats[keep, cv2.CC_STAT_HEIGHT] * y_scale,
+            'width': stats[keep, cv2.CC_STAT_WIDTH] * x_scale,
+            }
+
+
+def classify(blobs, shape):
+    """Tell what made the moving pixels of a frame.
+
+    'stream' if blobs at least STREAM_ASPECT times taller than wide
+     together span STREAM_SPAN of the ROI's height: a column of liquid,
+     whole or broken up, rather than a drop.
+    'ripple' if the largest blob is RIPPLE_ASPECT times wider than tall,
+     as a disturbed surface is, or if nothing is left after noise.
+    'drop' otherwise.
+
+    shape: shape of the full resolution ROI.
+
+    Returns: 'drop', 'ripple' or 'stream'
+    """
+    if not len(blobs['area']):
+        return 'ripple'
+
+    height = blobs['height']
+    width = blobs['width']
+    column = height >= STREAM_ASPECT * width
+    if height[column].sum() >= STREAM_SPAN * shape[0]:
+        return 'stream'
+
+    largest = np.argmax(blobs['area'])
+    if width[largest] >= RIPPLE_ASPECT * height[largest]:
+        return 'ripple'
+    return 'drop'
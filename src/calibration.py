@@ -0,0 +1,38 @@
+"""Calibration files.
+
+Calibration is what an experiment learns before it can detect drops:
+ ROI coordinates, optimal volts, DAC choice, noise statistics and
+ each detector's background. Saving it lets a restarted experiment
+ skip the warm-up and resume detection within a few frames.
+
+A calibration file is a numpy .npz archive of named arrays.
+Checkpoints of a running experiment are saved the same way.
+"""
+import os
+
+import numpy as np
+
+
+def save(path, state):
+    """Write [state], a dict of arrays, numbers and strings, to [path].
+
+    Written to a temporary file first, then moved over [path],
+     so a crash never leaves a half written calibration behind.
+    """
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as file:
+        np.savez(file, **state)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+
+def load(path):
+    """Read calibration written by save().
+
+    Returns: dict of numpy arrays, None if there is no file at [path]
+    """
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as archive:
+        return {name: archive[name] for name in archive.files}
@@ -0,0 +1,43 @@
+import time
+
+
+class Clock():
+    """Wall Clock.
+
+    Default time source of an experiment.
+    Every component reads time and sleeps through its clock,
+     so that a different time source can be swapped in.
+    """
+
+    def time(self):
+        """Return current time in seconds since the epoch."""
+        return time.time()
+
+    def sleep(self, seconds):
+        """Block for [seconds]."""
+        time.sleep(seconds)
+
+
+class FrameClock(Clock):
+    """Frame Driven Clock.
+
+    Time only moves when a new frame is read, as set by Monitor.
+    Used to replay recorded video faster than real time,
+     while drop times and valve delays behave as they did when recorded.
+    Sleeping returns immediately.
+    """
+
+    def __init__(self, start=0.0):
+        """Start clock at [start] seconds since the epoch."""
+        self.now = start
+
+    def time(self):
+        """Return time of the current frame."""
+        return self.now
+
+    def set(self, now):
+        """Move clock to the time of a new frame."""
+        self.now = now
+
+    def sleep(self, seconds):
+        """Do not block. Replayed frames are not waited on."""
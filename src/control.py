@@ -0,0 +1,176 @@
+import time
+
+from .dripper import Dripper
+from .telemetry import TelemetryServer
+from .valve import SimDac
+
+
+class Control(Dripper, ):
+    """Experiment Control Side.
+
+    The main drip point, the Drippers of further regions, and what is
+     reported about them, shared by Experiment and SplitExperiment.
+    Each feeds it the noise of every region through control_all(),
+     however it got the frames.
+    """
+
+    STATUS_INTERVAL = 1
+
+    def __init__(self, title='', user='Default', viscosity=50, **kwargs):
+        """Initialize control side.
+
+        If autostart=True calibration starts without waiting for '0'.
+
+        telemetry is a port to serve events and ROI previews on,
+         to telemetry_host, by default only this machine.
+         See telemetry.py.
+
+        started is the time.monotonic() the program started at,
+         by default now. Time from then to the first processed frame
+         is kept in first_frame and reported.
+
+        Region Drippers are added with add_dripper().
+
+        Uses autostart, telemetry, telemetry_host and started
+         in **kwargs if given.
+        Arguments are passed by keyword or by order.
+        Further kywd=arg pairs passed down MRO chain.
+        """
+        autostart = kwargs.pop('autostart') if 'autostart' in kwargs else False
+        port = kwargs.pop('telemetry') if 'telemetry' in kwargs else None
+        host = (kwargs.pop('telemetry_host') if 'telemetry_host' in kwargs
+                else '127.0.0.1')
+        started = (kwargs.pop('started') if 'started' in kwargs
+                   else time.monotonic())
+        super().__init__(title=title, user=user, viscosity=viscosity,
+                         **kwargs)
+
+        self.defaults_set = autostart
+        self.terminated = False
+        self.started = started
+        self.first_frame = None
+        self.__reported = self.beginning
+
+        self.drippers = {}
+
+        self.telemetry = None
+        if port is not None:
+            self.telemetry = TelemetryServer(host, port)
+            self.listeners.append(self.telemetry.publish)
+            print("Telemetry on http://{}:{}/".format(host,
+                                                      self.telemetry.port))
+
+    def add_dripper(self, name, coordinates, **kwargs):
+        """Make the Dripper run by region [name].
+
+        Unless given, the dripper shares the experiment's settings.
+        Its drop events are published by the experiment with region=name.
+        An external DAC needs an address of its own,
+         else an Exception is raised.
+        """
+        kwargs.setdefault('title', "{}_{}".format(self.title, name))
+        kwargs.setdefault('user', self.user)
+        kwargs.setdefault('viscosity', self.viscosity)
+        kwargs.setdefault('spd', self.seconds_per_drops)
+        kwargs.setdefault('dac', 'sim' if isinstance(self.dac, SimDac)
+                          else 'hw')
+        kwargs['clock'] = self.clock
+
+        if kwargs['dac'] in ('hw', 'auto'):
+            taken = [dripper.address for dripper in
+                     [self] + list(self.drippers.values())
+                     if dripper.dac_choice == 'hw']
+            if 'address' not in kwargs:
+                raise Exception("Region {} needs the address of its DAC."
+                                .format(name))
+            if kwargs['address'] in taken:
+                raise Exception("Region {} DAC address {:#x} is taken."
+                                .format(name, kwargs['address']))
+
+        dripper = Dripper(**kwargs)
+        dripper.listeners.append(
+            lambda event, data: self.publish(event, region=name, **data))
+        self.drippers[name] = dripper
+
+    def drip_points(self):
+        """Return (region name, Dripper) of every drip point (list)."""
+        return [('main', self)] + list(self.drippers.items())
+
+    def all_saturated(self):
+        """Return True once the main and every region's tank is full."""
+        return self.saturated and all(dripper.saturated for dripper
+                                      in self.drippers.values())
+
+    def control_all(self, noise, masks):
+        """Control every unsaturated drip point on the current frame.
+
+        noise: {region name: moving pixels}
+        masks: {region name: (foreground mask, full resolution shape)},
+         regions without one are controlled on noise alone.
+        """
+        if not self.saturated:
+            self.control(noise['main'], masks.get('main'))
+        for name, dripper in self.drippers.items():
+            if not dripper.saturated:
+                dripper.frame_no = self.frame_no
+                dripper.frame_time = self.frame_time
+                dripper.control(noise[name], masks.get(name))
+
+    def report_status(self):
+        """Publish a status event every STATUS_INTERVAL seconds.
+
+        Also keeps and prints time to the first processed frame, once.
+        """
+        if (self.listeners and self.frame_time - self.__reported
+                > self.STATUS_INTERVAL):
+            self.__reported = self.frame_time
+            self.publish('status', **self.status())
+        if self.first_frame is None:
+            self.report_first_frame()
+
+    def report_first_frame(self):
+        """Keep and print time from start to the first processed frame."""
+        self.first_frame = time.monotonic() - self.started
+        print("First frame processed {:.2f}s after start."
+              .format(self.first_frame))
+
+    def status(self):
+        """Return snapshot of the experiment's state (dict).
+
+        Each region's own snapshot is under 'regions', if any.
+        """
+        status = super().status()
+        if not self.defaults_set:
+            status['state'] = 'waiting'
+        if self.drippers:
+            status['regions'] = {name: dripper.status()
+                                 for name, dripper in self.drippers.items()}
+        return status
+
+    def summary(self):
+        """Print out essential experiment statistics."""
+        print(self.summary_text())
+
+    def summary_text(self):
+        """Return essential experiment statistics (str)."""
+        summary = """Final volts: {0}
+        Total drops: {1}
+        Average pixel noise: {2:.2f}
+        Average drop noise: {3:.2f}
+        Frames skipped: {4}
+        DAC writes: {5} ({6} unchanged, {7} coalesced)
+        Time to first frame: {8:.2f}s
+        """.format(self.volts,
+                   len(self.drops),
+                   self.get_noise_average(),
+                   self.get_drop_average(),
+                   self.frames_skipped,
+                   self.bus.writes,
+                   self.bus.skipped,
+                   self.actuator.coalesced,
+                   self.first_frame or 0,
+                   )
+        for name, dripper in self.drippers.items():
+            summary += "Region {0}: {1} volts, {2} drops\n        ".format(
+                name, dripper.volts, len(dripper.drops))
+        return summary
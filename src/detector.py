@@ -0,0 +1,155 @@
+import cv2
+import numpy as np
+
+
+class Detector():
+    """Drop Detector.
+
+    Turns each single channel ROI image into a foreground mask,
+     0 for still pixels and 255 for moving ones.
+    Every detector's mask is counted the same way by Monitor,
+     so noise values and thresholds mean the same for all of them.
+    """
+
+    def apply(self, image):
+        """Update background with [image]. Return its foreground mask."""
+        raise NotImplementedError
+
+    def reset(self):
+        """Forget the learnt background."""
+        raise NotImplementedError
+
+    def background(self):
+        """Return learnt background image, None if nothing learnt yet."""
+        raise NotImplementedError
+
+    def restore(self, background):
+        """Start from a [background] image saved by background().
+
+        It is used once the next image arrives, if their shapes match.
+        """
+        raise NotImplementedError
+
+
+class MOG2Detector(Detector):
+    """Gaussian Mixture Background Subtraction.
+
+    Required background subtractor parameters are:
+     [history, varThreshold, detectShadows]
+    Tweaking may be necessary for optimal results.
+
+    More on background subtraction methods at
+    https://docs.opencv.org/4.5.0/de/de1/group__video__motion.html
+    """
+
+    def __init__(self, history=40, var_threshold=60, shadows=False):
+        """Create OpenCV MOG2 background subtractor."""
+        self.parameters = (history, var_threshold, shadows)
+        self.reset()
+
+    def apply(self, image):
+        """Return foreground mask of [image]."""
+        if self.__seed is not None:
+            if self.__seed.shape == image.shape:
+                self.__back_sub.apply(self.__seed, learningRate=1)
+            self.__seed = None
+        return self.__back_sub.apply(image)
+
+    def reset(self):
+        """Start a new background model."""
+        self.__back_sub = cv2.createBackgroundSubtractorMOG2(*self.parameters)
+        self.__seed = None
+
+    def background(self):
+        """Return mean background image, None if nothing learnt yet."""
+        return self.__back_sub.getBackgroundImage()
+
+    def restore(self, background):
+        """Start a new background model from a [background] image.
+
+        MOG2 cannot be handed a model, so it learns the image
+         as its only frame instead. Spread around it is learnt anew.
+        """
+        self.reset()
+        self.__seed = background
+
+
+class DiffDetector(Detector):
+    """Running Average Frame Difference.
+
+    Much cheaper than MOG2: a pixel moves if it differs from a running
+     average background by more than [threshold] grey levels.
+    Background learns 1/2^[shift] of each new frame.
+
+    Background is kept in 12.4 fixed point in int16,
+     and all work is done in preallocated integer buffers.
+    """
+
+    FRACTION = 4
+
+    def __init__(self, threshold=25, shift=3):
+        """Create detector. Background starts from the first frame."""
+        self.threshold = threshold << self.FRACTION
+        self.shift = shift
+        self.reset()
+
+    def apply(self, image):
+        """Return foreground mask of [image]."""
+        if self.__background is None or image.shape != self.__mask.shape:
+            seed = self.__seed
+            self.__seed = None
+            if seed is None or seed.shape != image.shape:
+                self.__allocate(image)
+                return self.__mask
+            self.__allocate(seed)
+
+        np.left_shift(image, self.FRACTION, out=self.__delta,
+                      dtype=np.int16)
+        np.subtract(self.__delta, self.__background, out=self.__delta)
+        np.abs(self.__delta, out=self.__distance)
+        np.greater(self.__distance, self.threshold, out=self.__moving)
+        np.multiply(self.__moving, 255, out=self.__mask, casting='unsafe')
+
+        np.right_shift(self.__delta, self.shift, out=self.__delta)
+        np.add(self.__background, self.__delta, out=self.__background)
+
+        return self.__mask
+
+    def reset(self):
+        """Forget background. Next frame becomes the new background."""
+        self.__background = None
+        self.__seed = None
+        self.__mask = np.zeros(0, dtype=np.uint8)
+
+    def background(self):
+        """Return running average background, None if nothing learnt yet."""
+        if self.__background is None:
+            return None
+        return np.right_shift(self.__background,
+                              self.FRACTION).astype(np.uint8)
+
+    def restore(self, background):
+        """Start from a [background] image instead of the next frame."""
+        self.reset()
+        self.__seed = background
+
+    def __allocate(self, image):
+        """Make buffers for [image]'s shape, seed background with it."""
+        self.__background = np.left_shift(image, self.FRACTION,
+                                          dtype=np.int16)
+        self.__delta = np.empty(image.shape, dtype=np.int16)
+        self.__distance = np.empty(image.shape, dtype=np.int16)
+        self.__moving = np.empty(image.shape, dtype=bool)
+        self.__mask = np.zeros(image.shape, dtype=np.uint8)
+
+
+DETECTORS = {'mog2': MOG2Detector,
+             'diff': DiffDetector,
+             }
+
+
+def create_detector(detector='mog2'):
+    """Return a Detector. Accepts a name in DETECTORS or a Detector."""
+    if isinstance(detector, Detector):
+        return detector
+    return DETECTORS[detector]()
@@ -0,0 +1,358 @@
+import datetime
+import os
+
+from .analysis import DROP_COLUMNS, read_log
+from .blobs import analyze, classify
+from .log import ExperimentLog
+from .model import Model
+from .valve import Valve
+
+
+class Dripper(Valve, Model, ):
+    """Drip Point Controller.
+
+    A valve, the model of the drops it lets through, and the control
+     algorithm tying them together. Drops are streamed to its own log.
+
+    Dripper does not see. It is fed the moving pixel count of each frame
+     through control(), along with frame_no, frame_time and optionally
+     frame_stamp.
+    An Experiment is a Dripper with a camera. Further drip points watched
+     by the same camera are plain Drippers fed by the Experiment.
+    If it is also fed the frame's foreground mask, noise spikes are told
+     apart by the shape of their blobs, so a stream is seen as one.
+    """
+
+    MIN_NOISE = 50
+    CLOG_DELAY = 30
+    NOISE_SPIKE = 5
+    RIPPLE_DELAY = 0.1
+    CALIBRATION_FRAMES = 250
+    THROTTLE_DELAY = 2
+    SMOOTHING = 8
+
+    def __init__(self, title='', user='Default', viscosity=50, **kwargs):
+        """Initialize Dripper.
+
+        Dripper properties include:
+         title and date of the drip point,
+         viscosity of the liquid being used,
+         time it started,
+         and any notes added by the user.
+
+        The log header is written as soon as the dripper starts.
+         Logs are named after title and date, to the minute. If that log
+         already exists, e.g. the dripper restarted within the minute,
+         the date is numbered, [date]_2 and so on, so it is kept.
+
+        To continue an earlier run give its [date], which names the log,
+         and append=True to add to its log instead of starting over.
+         Its state is then restored with set_run_state().
+
+        Uses date and append in **kwargs if given.
+        Arguments are passed by keyword or by order.
+        Further kywd=arg pairs passed down MRO chain.
+        """
+        date = kwargs.pop('date') if 'date' in kwargs else None
+        append = kwargs.pop('append') if 'append' in kwargs else False
+        super().__init__(**kwargs)
+
+        self.title = title
+        self.date = date or self.__new_date()
+        self.filename = self.title + "_" + self.date
+
+        self.user = user
+        self.viscosity = viscosity
+        self.notes = ['self.add_notes(0)']
+        self.beginning = self.clock.time()
+
+        self.frame_no = 0
+        self.frame_time = self.beginning
+        self.frame_stamp = None
+        self.calibrated_at = self.CALIBRATION_FRAMES
+        self.listeners = []
+
+        self.flow = 0
+        self.last_stream_time = -float('inf')
+        self.drop_area = None
+        self.transit = self.RIPPLE_DELAY
+        self.__spike = None
+        self.__throttled = -float('inf')
+
+        self.log = ExperimentLog(self.filename, self.__header(), append)
+
+        print(":: DRIPPER INITIALIZED ::\n")
+
+    def control(self, noise, mask=None):
+        """Apply the control algorithm to the noise of one frame.
+
+        Calibrates until frame calibrated_at, then looks for noise spikes
+         above the calibrated noise. A spike is checked for a new drop,
+         no drop or stream for CLOG_DELAY seconds means the valve is
+         clogged.
+        How long spikes last is smoothed into transit, the time
+         liquid takes to fall through the ROI.
+
+        frame_no and frame_time must be those of the frame [noise] is from.
+        mask: (foreground mask, full resolution ROI shape) of the frame,
+         its blobs are only looked at for spikes. See check_for_drop.
+        """
+        if (self.frame_no > self.calibrated_at):
+            threshold = max(self.get_noise_level()
+                            * self.NOISE_SPIKE, self.MIN_NOISE)
+            time_since_flow = self.frame_time - max(self.last_drop_time,
+                                                    self.last_stream_time)
+
+            if noise <= threshold and self.__spike is not None:
+                self.transit += ((self.frame_time - self.__spike
+                                  - self.transit) / self.SMOOTHING)
+                self.__spike = None
+
+            if noise > threshold:
+                if self.__spike is None:
+                    self.__spike = self.frame_time
+                self.check_for_drop(noise, mask)
+            elif (time_since_flow > self.CLOG_DELAY):
+                if not self.clogged and self.listeners:
+                    self.publish('clog', frame=self.frame_no,
+                                 time=self.frame_time - self.beginning)
+                self.saturated = self.set_clog_volts()
+            else:
+                self.add_noise(self.frame_no, noise)
+
+        else:
+            self.add_noise(self.frame_no, noise)
+
+    def recalibrate(self):
+        """Calibrate again for CALIBRATION_FRAMES from the current frame.
+
+        The noise average starts over, so it only holds the new frames.
+        """
+        print("Recalibrating...")
+        self.calibrated_at = self.frame_no + self.CALIBRATION_FRAMES
+        self.reset_noise()
+
+    def get_run_state(self):
+        """Return state needed to continue this run elsewhere (dict)."""
+        state = {'date': self.date,
+                 'beginning': self.beginning,
+                 'frame_no': self.frame_no,
+                 'calibrated_at': self.calibrated_at,
+                 'notes': self.notes,
+                 }
+        state.update(self.get_model_state())
+        state.update(self.get_valve_state())
+        return state
+
+    def set_run_state(self, state):
+        """Carry on from state returned by get_run_state().
+
+        Drops logged since the state was saved are read back from the log.
+        """
+        self.beginning = float(state['beginning'])
+        self.frame_no = int(state['frame_no'])
+        self.calibrated_at = int(state['calibrated_at'])
+        self.notes = state['notes'].tolist()
+        self.set_model_state(state)
+        self.set_valve_state(state)
+        self.__recover_drops()
+
+    def check_for_drop(self, noise, mask=None):
+        """Confirm that noise spike is due to new drop and not ripple.
+
+        Times are taken from when the frame was captured,
+         not from when it was processed.
+        If profiling, time from frame_stamp to the new voltage being
+         written to the DAC is recorded as 'drop_latency', see Actuator.
+
+        Given the frame's [mask], its blobs are classified first,
+         see blobs.classify. A stream is handled by stream(),
+         a ripple shaped spike is never taken as a drop.
+        Without one, any spike RIPPLE_DELAY after a drop is a drop.
+
+        Returns: True if a new drop was added, else False
+        """
+        kind = None
+        if mask is not None:
+            profiler = self.profiler
+            if profiler:
+                mark = profiler.start()
+            blobs = analyze(*mask)
+            kind = classify(blobs, mask[1])
+            if profiler:
+                profiler.stop('blobs', mark)
+            if kind == 'stream':
+                self.stream(noise, blobs['area'].sum())
+                return False
+
+        last_drop_time = self.last_drop_time
+        time_since_drop = self.frame_time - last_drop_time
+        if time_since_drop > self.RIPPLE_DELAY and kind != 'ripple':
+            print("Drop! {:.2f}s since last drop".format(time_since_drop))
+            self.flow = 1 / time_since_drop
+            if kind == 'drop':
+                area = blobs['area'].sum()
+                self.drop_area = (area if self.drop_area is None else
+                                  self.drop_area + (area - self.drop_area)
+                                  / self.SMOOTHING)
+            self.add_drop(self.frame_no, noise, self.beginning, self.volts,
+                          self.frame_time)
+            self.calculate(self.viscosity,
+                           self.seconds_per_drops,
+                           last_drop_time,
+                           self.frame_stamp,
+                           self.frame_time,
+                           )
+            self.equalize()
+            return True
+
+        print("Ripple effect")
+        if self.listeners:
+            self.publish('ripple', frame=self.frame_no, noise=noise,
+                         time=self.frame_time - self.beginning)
+        return False
+
+    def stream(self, noise, area):
+        """Handle a frame of continuous flow.
+
+        Flow is estimated in drops per second as the liquid in view,
+         [area] over the area of a drop, falling through in transit.
+        Until a drop was measured its area is taken as the
+         average drop noise, or failing that the least spike.
+        The valve is throttled right away, then at most every
+         THROTTLE_DELAY seconds while the stream lasts, to let it settle.
+        A stream lasts until THROTTLE_DELAY passed without one, it is
+         only reported and published as 'stream' when it starts.
+        """
+        drop_area = self.drop_area
+        if drop_area is None:
+            drop_area = max(self.get_drop_average(), self.MIN_NOISE)
+        self.flow = area / drop_area / self.transit
+        starting = (self.frame_time - self.last_stream_time
+                    > self.THROTTLE_DELAY)
+        self.last_stream_time = self.frame_time
+        if starting:
+            print("Stream! ~{:.1f} drops/s".format(self.flow))
+            if self.listeners:
+                self.publish('stream', frame=self.frame_no, noise=noise,
+                             flow=self.flow,
+                             time=self.frame_time - self.beginning)
+
+        if self.frame_time - self.__throttled > self.THROTTLE_DELAY:
+            self.__throttled = self.frame_time
+            self.throttle(self.flow, 1 / self.seconds_per_drops)
+
+    def publish(self, event, **data):
+        """Pass event and its data to every listener.
+
+        Listeners are callables taking (event name, data dict),
+         appended to self.listeners by e.g. a supervisor.
+        They run on the main loop so must return quickly.
+        """
+        for listener in self.listeners:
+            listener(event, data)
+
+    def status(self):
+        """Return snapshot of the dripper's state (dict)."""
+        if self.frame_no <= self.calibrated_at:
+            state = 'calibrating'
+        elif self.frame_time - self.last_stream_time <= self.THROTTLE_DELAY:
+            state = 'streaming'
+        elif self.saturated:
+            state = 'saturated'
+        elif self.clogged:
+            state = 'clogged'
+        else:
+            state = 'running'
+
+        return {'title': self.title,
+                'state': state,
+                'time': self.frame_time - self.beginning,
+                'frame': self.frame_no,
+                'drops': len(self.drops),
+                'volts': self.volts,
+                'clog_volts': self.clog_volts,
+                'noise_average': self.get_noise_average(),
+                'noise_level': self.get_noise_level(),
+                'noise_std': self.noise_stats.std(),
+                'time_since_drop': self.frame_time - self.last_drop_time,
+                'flow': self.flow,
+                }
+
+    def add_noise(self, frame_no, noise):
+        """Add noise data to model and stream it to the noise log."""
+        super().add_noise(frame_no, noise)
+        self.log.noise((frame_no, noise))
+
+    def add_drop(self, frame_no, noise, beginning, volts, timestamp=None):
+        """Add drop data to model and stream it to the drop log."""
+        super().add_drop(frame_no, noise, beginning, volts, timestamp)
+        self.log.drop(self.drops.last())
+        if self.listeners:
+            self.publish('drop', frame=frame_no, noise=noise, volts=volts,
+                         time=self.last_drop_time - beginning)
+
+    def footer(self):
+        """Return text closing the drop log."""
+        emptied = "Succesful" if self.saturated else "Unsuccesful"
+        return """Tank emptied: {0}
+        Final voltage: {1}
+        Total drops: {2}
+        Average pixel noise: {3}
+        Average drop noise: {4}
+        """.format(emptied,
+                   str(self.volts),
+                   str(len(self.drops)),
+                   str(self.get_noise_average()),
+                   str(self.get_drop_average()),
+                   )
+
+    def finish(self):
+        """Close the log with its footer. Wait for the valve to close.
+
+        Closing is started by actuator.shutoff(), ideally well before.
+        """
+        self.log.close(self.footer())
+        self.actuator.stop()
+
+    def __recover_drops(self):
+        """Add drops logged after the run state was saved.
+
+        Those rows are already in the log, so the drop history,
+         drop noise and footer are made to agree with it.
+        Frames are numbered on from the last of them.
+        """
+        drops = read_log(self.filename + ".txt", noise=False)['drops']
+        for index in range(len(self.drops), len(drops['time'])):
+            row = [drops[name][index].item() for name in DROP_COLUMNS]
+            self.drops.append(row)
+            self.drop_sum += row[4]
+            self.frame_no = max(self.frame_no, int(row[2]))
+
+    def __new_date(self):
+        """Return date of a new log, numbered if its log exists."""
+        date = datetime.datetime.fromtimestamp(
+            self.clock.time()).strftime("%M.%H.%m.%d.%Y")
+        numbered = date
+        count = 1
+        while os.path.exists(self.title + "_" + numbered + ".txt"):
+            count += 1
+            numbered = "{}_{}".format(date, count)
+        return numbered
+
+    def __header(self):
+        """Return text heading the drop log."""
+        return """Title: {0}
+        Date: {1}
+        User/s: {2}
+        Viscosity: {3}
+        Seconds per drop: {4}
+        Notes: {5}
+        TotalTime\tTimeSinceDrop\tFrame\tMovingPixelAvg\tMovingPixels\tVoltage
+        """.format(self.title,
+                   self.date,
+                   self.user,
+                   self.viscosity,
+                   self.seconds_per_drops,
+                   self.notes[0],
+                   )
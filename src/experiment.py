@@ -1,8 +1,7 @@
-import datetime
+import os
 import select
 import sys
-import time
-from multiprocessing import Process
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     import termios
@@ -11,12 +10,12 @@ except Exception as exc:
     print("Exception: {}\n".format(exc))
     termios_lib = False
 
-from .model import Model
-from .monitor import Monitor
-from .valve import Valve, shutoff_valve
+from . import calibration
+from .control import Control
+from .monitor import EndOfStream, Monitor
 
 
-class Experiment(Monitor, Valve, Model, ):
+class Experiment(Monitor, Control, ):
     """Automated Saturation System Experiment.
 
     Uses multiple inheritance to acess each
@@ -28,17 +27,17 @@ class Experiment(Monitor, Valve, Model, ):
     Furthermore, contains all data and methods
      related to said data on the experiment.
 
+    Further drip points seen by the same camera
+     are each run by their own Dripper, see Control.
+
     TODO: Improve constants experimentally
      or automate them.
     TODO: Integrate machine learning infrastructure
      for eventual ML implementation.
     """
 
-    MIN_NOISE = 50
-    CLOG_DELAY = 30
-    NOISE_SPIKE = 5
-    RIPPLE_DELAY = 0.1
-    CALIBRATION_FRAMES = 250
+    CHECKPOINT_INTERVAL = 10
+    WARM_FRAMES = 5
 
     def __init__(self, title='', user='Default', viscosity=50, **kwargs):
         """Initialize Experiment Class.
@@ -49,21 +48,103 @@ class Experiment(Monitor, Valve, Model, ):
          time the experiment started,
          and any notes added by the user.
 
-        Arguments are passed by keyword or by order.
-        Further kywd=arg pairs passed down MRO chain.
-        """
-        super().__init__(**kwargs)
+        The log header is written as soon as the experiment starts.
+         Drop and noise rows are then streamed to the log as they occur.
+
+        Side tasks such as notes run on a pool of [workers] threads
+         made once here. Their results come back through futures.
+
+        If interactive=False no final notes are asked for at the end.
+
+        regions adds drip points beside the main ROI, as a list of dicts:
+         {'name': 'b', 'coordinates': [west, north, east, south], ...}
+        Other keys are passed to that region's Dripper, e.g. address,
+         volts, viscosity or spd. Its log is titled [title]_[name].
+        Region DACs are simulated if the main DAC is, else 'hw',
+         which needs an address no other drip point uses.
+
+        calibration is the path of a calibration file, see calibration.py.
+         It is saved once calibrated and again at termination.
+         If it exists at startup, saved ROI coordinates and optimal volts
+         replace those given. Unless given, a saved external DAC and its
+         address are used. A simulated DAC is not, so a run that fell
+         back on one does not keep later runs from asking.
+         Noise statistics and detector backgrounds are restored too,
+         so drops are looked for after WARM_FRAMES instead.
 
-        self.title = title
-        self.date = datetime.datetime.now().strftime("%M.%H.%m.%d.%Y")
-        self.filename = self.title + "_" + self.date
+        checkpoint is the path the run state of every drip point is saved
+         to every CHECKPOINT_INTERVAL seconds, by a worker thread.
+         It is removed once the experiment terminates properly.
+        If resume=True the checkpoint is loaded at startup. Its logs are
+         continued and control carries on after WARM_FRAMES.
 
-        self.user = user
-        self.viscosity = viscosity
-        self.notes = ['self.add_notes(0)']
-        self.beginning = time.time()
+        autostart, telemetry, telemetry_host and started
+         are used by Control.
 
-        self.defaults_set = False
+        Arguments are passed by keyword or by order.
+        Further kywd=arg pairs passed down MRO chain.
+        """
+        interactive = (kwargs.pop('interactive') if 'interactive' in kwargs
+                       else True)
+        workers = kwargs.pop('workers') if 'workers' in kwargs else 2
+        regions = kwargs.pop('regions') if 'regions' in kwargs else []
+        path = (kwargs.pop('calibration') if 'calibration' in kwargs
+                else None)
+        checkpoint = (kwargs.pop('checkpoint') if 'checkpoint' in kwargs
+                      else None)
+        resume = kwargs.pop('resume') if 'resume' in kwargs else False
+
+        saved = calibration.load(path) if path else None
+        if saved:
+            regions = [dict(region) for region in regions]
+            for region in [kwargs] + regions:
+                name = region.get('name', 'main')
+                if name + '.coordinates' in saved:
+                    region['coordinates'] = \
+                        saved[name + '.coordinates'].tolist()
+                    region['volts'] = saved[name + '.volts'].item()
+            if str(saved['dac']) == 'hw':
+                kwargs.setdefault('dac', 'hw')
+                kwargs.setdefault('address', int(saved['address']))
+
+        resumed = None
+        if resume:
+            resumed = calibration.load(checkpoint) if checkpoint else None
+            if not resumed:
+                raise Exception("No checkpoint to resume from at {}"
+                                .format(checkpoint))
+            regions = [dict(region) for region in regions]
+            for region in [kwargs] + regions:
+                name = region.get('name', 'main')
+                region['date'] = str(resumed[name + '.date'])
+                region['append'] = True
+
+        kwargs['regions'] = {region['name']: region['coordinates']
+                             for region in regions}
+        super().__init__(title=title, user=user, viscosity=viscosity,
+                         **kwargs)
+
+        self.interactive = interactive
+
+        self.workers = ThreadPoolExecutor(workers)
+        self.__tasks = []
+        self.__noting = False
+
+        self.checkpoint = checkpoint
+        self.__checkpointed = self.beginning
+        self.__saving = None
+
+        for region in regions:
+            self.add_dripper(**region)
+
+        if self.recorder:
+            self.listeners.append(self.__record)
+
+        self.calibration = path
+        if saved:
+            self.__warm_start(saved)
+        if resumed:
+            self.__resume(resumed)
 
         print(":: EXPERIMENT INITIALIZED ::\n")
 
@@ -73,38 +154,72 @@ class Experiment(Monitor, Valve, Model, ):
         Fundamentally a finite state machine, it applies methods
          corresponding to its current state (calibrated, saturated, ...)
 
+        Runs step() until every drip point is saturated,
+         the video ends or interrupted, then terminates.
+
         TODO: Improve control algorithm.
         TODO: Implement calibration reset system.
         """
         try:
-            while not self.saturated:
-                self.get_frame()
-                if self.defaults_set:
-                    noise = self.image_processing()
-                    if (self.frame_no > self.CALIBRATION_FRAMES):
-                        threshold = max(self.get_noise_average()
-                                        * self.NOISE_SPIKE, self.MIN_NOISE)
-                        time_since_drop = time.time() - self.last_drop_time
-
-                        if noise > threshold:
-                            self.check_for_drop(noise)
-                        elif (time_since_drop > self.CLOG_DELAY):
-                            self.saturated = self.set_clog_volts()
-                        else:
-                            self.add_noise(self.frame_no, noise)
-
-                    else:
-                        self.add_noise(self.frame_no, noise)
-
-                key = self.show_frame()
-                self.key_input(key)
-
+            try:
+                while not self.all_saturated() and self.step():
+                    pass
+            except KeyboardInterrupt:
+                print("Program interrupted by keyboard!")
             self.terminate()
 
         except Exception as exc:
             print("Exception:", exc)
+            self.log.close()
+            for dripper in self.drippers.values():
+                dripper.log.close()
             print("Shutdown complete")
 
+    def step(self):
+        """Process a single frame through the control algorithm.
+
+        The frame is processed once for all regions,
+         then each unsaturated drip point is controlled on its own noise.
+
+        If profiling, each step is timed as a 'frame' stage.
+        Time from start to the end of the first step is kept once.
+        If anyone is listening, a status event is published
+         every STATUS_INTERVAL seconds.
+
+        Returns: False once a replayed video ends, else True
+        """
+        if self.profiler:
+            mark = self.profiler.start()
+        try:
+            self.get_frame()
+        except EndOfStream as exc:
+            print(exc)
+            return False
+        if self.telemetry and self.telemetry.wants_preview():
+            self.telemetry.preview(self.roi_frame())
+
+        if self.defaults_set:
+            self.image_processing()
+            self.control_all(self.region_noise, self.masks)
+            if self.calibration and self.frame_no == self.calibrated_at:
+                self.save_calibration()
+            if self.heatmap and self.frame_no >= self.calibrated_at:
+                self.propose_roi()
+                if self.auto_roi is True:
+                    self.fit_roi()
+
+        key = self.show_frame()
+        self.key_input(key)
+        if self.__tasks:
+            self.collect()
+        if (self.checkpoint and self.frame_time - self.__checkpointed
+                > self.CHECKPOINT_INTERVAL):
+            self.save_checkpoint()
+        self.report_status()
+        if self.profiler:
+            self.profiler.stop('frame', mark)
+        return True
+
     def key_input(self, key):
         """Send keyboard input to each components' input methods.
 
@@ -125,121 +240,175 @@ class Experiment(Monitor, Valve, Model, ):
         key = key & 0xDF
         if key == ord('R'):
             self.defaults_set = False
-        elif key == ord('N'):
-            parallelize(self.add_notes, (self.frame_no,))
+        elif key == ord('N') and not self.__noting:
+            self.__noting = True
+            self.hold_keys = self.headless
+            self.submit(self.add_notes, self.__add_note, self.frame_no)
+        elif key == ord('F'):
+            self.fit_roi()
         elif key == ord('Q'):
             print("Program terminated by keyboard input!")
             self.terminate()
 
-    def check_for_drop(self, noise):
-        """Confirm that noise spike is due to new drop and not ripple.
+    def fit_roi(self):
+        """Move ROI to the one proposed from calibration motion.
 
-        TODO: Find better method than just time delay.
-         Might cause system to miss streams.
+        The moved ROI sees different noise, so calibration starts over.
+        """
+        if self.apply_roi():
+            self.recalibrate()
+
+    def save_calibration(self):
+        """Save calibration of every drip point to the calibration file."""
+        state = {'dac': self.dac_choice or '', 'address': self.address}
+        for name, dripper in self.drip_points():
+            state[name + '.coordinates'] = self.regions[name]
+            state[name + '.volts'] = dripper.get_optimal_volts()
+            state[name + '.noise'] = dripper.get_noise_state()
+            background = self.detectors[name].background()
+            if background is not None:
+                state[name + '.background'] = background
+        calibration.save(self.calibration, state)
+        print("Calibration saved to {}".format(self.calibration))
+
+    def save_checkpoint(self):
+        """Save run state of every drip point to the checkpoint file.
+
+        State is copied here, the file is written by a worker thread.
+        Skipped while the previous checkpoint is still being written.
         """
-        if (time.time() - self.last_drop_time) > self.RIPPLE_DELAY:
-            time_since_drop = time.time() - self.last_drop_time
-            print("Drop! {:.2f}s since last drop".format(time_since_drop))
-            self.add_drop(self.frame_no, noise, self.beginning, self.volts)
-            self.calculate(self.viscosity,
-                           self.seconds_per_drops,
-                           self.last_drop_time
-                           )
-            self.equalize()
-        else:
-            print("Ripple effect")
+        if self.__saving and not self.__saving.done():
+            return
+        self.__checkpointed = self.frame_time
+
+        state = {'defaults_set': self.defaults_set}
+        for name, dripper in self.drip_points():
+            for key, value in dripper.get_run_state().items():
+                state[name + '.' + key] = value
+        self.__saving = self.workers.submit(calibration.save,
+                                            self.checkpoint, state)
 
     def add_notes(self, frame_no):
-        """Add user notes to experiment data."""
+        """Ask user for notes. Run on the worker pool.
+
+        Returns: note labelled with the frame it was asked at (str)
+        """
         notes = input_with_timeout("Notes: ", 30)
-        self.notes.append("Notes at frame [{}]: {}".format(frame_no, notes))
-
-    def summary(self):
-        """Print out essential experiment statistics."""
-        summary = """Final volts: {0}
-        Total drops: {1}
-        Average pixel noise: {2:.2f}
-        Average drop noise: {3:.2f}
-        """.format(self.volts,
-                   len(self.drops),
-                   self.get_noise_average(),
-                   self.get_drop_average()
-                   )
-        print(summary)
+        return "Notes at frame [{}]: {}".format(frame_no, notes)
+
+    def submit(self, function, callback, *args):
+        """Run function(*args) on the worker pool.
+
+        Once finished, callback is called with its result
+         by the main loop, so the result can touch experiment state.
+        """
+        self.__tasks.append((self.workers.submit(function, *args), callback))
+
+    def collect(self):
+        """Hand results of finished side tasks to their callbacks."""
+        running = []
+        for future, callback in self.__tasks:
+            if future.done():
+                callback(future.result())
+            else:
+                running.append((future, callback))
+        self.__tasks = running
 
     def terminate(self):
         """Execute termination procedure.
 
-        1. Terminate OpenCV/Vision processes.
-        2. Fully close valve.
+        1. Start fully closing every valve.
+        2. Terminate OpenCV/Vision processes.
         3. Print summary.
-        4. Compile collected experiment data into strings
-        5. Write collected drop data to text file.
-        6. Write collected noise data to text file
+        4. Write footer, profile if any, and notes to the log.
+        5. Flush and close the logs.
+        6. Wait for the valves to finish closing.
         """
         print("Terminating...\n")
-        parallelize(shutoff_valve, (self.dac,))
+        self.actuator.shutoff()
+        for dripper in self.drippers.values():
+            dripper.actuator.shutoff()
+        if self.calibration and self.frame_no > self.calibrated_at:
+            self.save_calibration()
         self.shutoff_vision()
         self.summary()
-
-        emptied = "Succesful" if self.saturated else "Unsuccesful"
-        initial_data = """Title: {0}
-        Date: {1}
-        User/s: {2}
-        Viscosity: {3}
-        Seconds per drop: {4}
-        Notes: {5}
-        TotalTime\tTimeSinceDrop\tFrame\tMovingPixelAvg\tMovingPixels\tVoltage
-        """.format(self.title,
-                   self.date,
-                   self.user,
-                   self.viscosity,
-                   self.seconds_per_drops,
-                   self.notes[0],
-                   )
-
-        final_data = """Tank emptied: {0}
-        Final voltage: {1}
-        Total drops: {2}
-        Average pixel noise: {3}
-        Average drop noise: {4}
-        """.format(emptied,
-                   str(self.volts),
-                   str(len(self.drops)),
-                   str(self.get_noise_average()),
-                   str(self.get_drop_average()),
-                   )
-
-        drop_file = open(self.filename + ".txt", "w")
-        write = drop_file.write
-
-        write(initial_data)
-        for drop in self.drops:
-            write("{0}\t{1}\t{2}\t{3}\t{4}\t{5}\n".format(*drop))
-        write(final_data)
+        if self.telemetry:
+            self.listeners.remove(self.telemetry.publish)
+            self.telemetry.stop()
+
+        final_data = self.footer()
+        if self.profiler:
+            final_data += self.profiler.report("\n        ")
+        self.collect()
         for note in range(1, len(self.notes)):
-            write(self.notes[note])
-        if termios_lib:
+            final_data += self.notes[note]
+        if termios_lib and self.interactive:
             final_notes = input_with_timeout("Final Notes: ", 30)
-            write("Final Notes: " + final_notes)
-        drop_file.close()
-
-        noise_file = open(self.filename + "_Noise.txt", "w")
-        for noise in self.noise:
-            noise_file.write("{}\t{}\n".format(*noise))
-        noise_file.close()
+            final_data += "Final Notes: " + final_notes
+        self.log.close(final_data)
+        if self.__saving:
+            self.__saving.result()
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+        self.workers.shutdown(wait=False, cancel_futures=True)
+        self.actuator.stop()
+        for dripper in self.drippers.values():
+            dripper.finish()
+        self.terminated = True
 
         raise Exception("Program has been quit")
 
+    def __warm_start(self, saved):
+        """Restore noise statistics and backgrounds of a saved calibration.
 
-def parallelize(function, arguments=None):
-    """Parallelize functions so as to not interrupt valve operation."""
-    if arguments:
-        t = Process(target=function, args=arguments)
-    else:
-        t = Process(target=function)
-    t.start()
-    t.join()
+        Calibration is cut down to WARM_FRAMES and starts right away.
+        """
+        for name, dripper in self.drip_points():
+            if name + '.noise' in saved:
+                dripper.set_noise_state(saved[name + '.noise'].tolist())
+                dripper.calibrated_at = self.WARM_FRAMES
+            if name + '.background' in saved:
+                self.detectors[name].restore(saved[name + '.background'])
+
+        self.defaults_set = True
+        self.heatmap = None
+        print("Warm start from {}: saved ROI, optimal volts and noise are"
+              " used, calibration is skipped.".format(self.calibration))
+
+    def __resume(self, resumed):
+        """Carry on from the run state of a checkpoint.
+
+        Logs are already continued. Frames are numbered on from
+         the checkpoint, drops are looked for after WARM_FRAMES.
+        """
+        for name, dripper in self.drip_points():
+            prefix = name + '.'
+            dripper.set_run_state({key[len(prefix):]: value
+                                   for key, value in resumed.items()
+                                   if key.startswith(prefix)})
+            dripper.calibrated_at = max(dripper.calibrated_at,
+                                        dripper.frame_no + self.WARM_FRAMES)
+            dripper.notes.append("Resumed at frame [{}]"
+                                 .format(dripper.frame_no))
+
+        self.defaults_set = bool(resumed['defaults_set'])
+        self.heatmap = None
+        print("Resumed from {}".format(self.checkpoint))
+
+    def __record(self, event, data):
+        """Record a clip of drop, ripple, stream and clog events."""
+        if event in ('drop', 'ripple', 'stream', 'clog'):
+            self.recorder.trigger("{}_{}{}_{}".format(
+                self.title,
+                data['region'] + "_" if 'region' in data else "",
+                event,
+                data['frame']))
+
+    def __add_note(self, note):
+        """Keep note for the log. Give keys back to the main loop."""
+        self.notes.append(note)
+        self.__noting = False
+        self.hold_keys = False
 
 
 def input_with_timeout(prompt, timeout):
@@ -0,0 +1,93 @@
+import tempfile
+
+import numpy as np
+
+
+class History():
+    """Bounded Record History.
+
+    Stores fixed width records in a preallocated numpy structured array.
+    When the in-memory window fills up its oldest half is spilled
+     to a temporary file, so memory use stays flat on long runs.
+
+    Records are iterated oldest first, from disk then from memory,
+     as tuples of plain Python values.
+    Records kept elsewhere, e.g. in a log, can be counted in without
+     being held, see skip().
+    """
+
+    def __init__(self, fields, size=65536, directory=None):
+        """Allocate window of [size] records laid out as [fields].
+
+        fields: list of (name, numpy type) pairs.
+        directory: where spilled records go. Defaults to system temp dir.
+        """
+        self.dtype = np.dtype(fields)
+        self.__rows = np.zeros(max(2, size), dtype=self.dtype)
+        self.__length = 0
+        self.__spilled = 0
+        self.__skipped = 0
+        self.__directory = directory
+        self.__file = None
+
+    def __len__(self):
+        """Return total amount of records, spilled, skipped or not."""
+        return self.__skipped + self.__spilled + self.__length
+
+    def __iter__(self):
+        """Yield every record as a tuple, oldest first."""
+        if self.__spilled:
+            self.__file.flush()
+            chunk = len(self.__rows)
+            for start in range(0, self.__spilled, chunk):
+                self.__file.seek(start * self.dtype.itemsize)
+                rows = np.fromfile(self.__file, dtype=self.dtype,
+                                   count=min(chunk, self.__spilled - start))
+                yield from rows.tolist()
+
+        yield from self.__rows[:self.__length].tolist()
+
+    def skip(self, count):
+        """Count [count] earlier records in without holding them.
+
+        They add to len() but are not iterated.
+        """
+        self.__skipped += count
+
+    def append(self, row):
+        """Add record. Spill oldest half of window to disk if full."""
+        if self.__length == len(self.__rows):
+            self.__spill(len(self.__rows) // 2)
+
+        self.__rows[self.__length] = tuple(row)
+        self.__length += 1
+
+    def window(self):
+        """Return records still held in memory, oldest first (array view)."""
+        return self.__rows[:self.__length]
+
+    def last(self):
+        """Return most recent record as a tuple. If none return None."""
+        if self.__length:
+            return self.__rows[self.__length - 1].item()
+        return None
+
+    def close(self):
+        """Delete spilled records. History is empty afterwards."""
+        if self.__file:
+            self.__file.close()
+            self.__file = None
+        self.__length = self.__spilled = self.__skipped = 0
+
+    def __spill(self, amount):
+        """Append oldest [amount] records to disk, shift rest to front."""
+        if self.__file is None:
+            self.__file = tempfile.TemporaryFile(dir=self.__directory)
+
+        self.__file.seek(0, 2)
+        self.__file.write(self.__rows[:amount].tobytes())
+        self.__spilled += amount
+
+        self.__length -= amount
+        self.__rows[:self.__length] = self.__rows[amount:amount
+                                                  + self.__length]
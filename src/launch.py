@@ -0,0 +1,138 @@
+"""Launch an experiment from the command line or a config file.
+
+Every Experiment, Monitor, Valve and Model option can be set here,
+ so an experiment can start without any prompt, e.g. when restarted
+ unattended or replayed by a script. Vision and hardware libraries are
+ only imported once the options are read, and how long it took from
+ launch to the first processed frame is reported.
+
+Config is a JSON object of Experiment keyword arguments:
+    {"title": "ASS_v5", "user": "Lab", "viscosity": 30, "spd": 2,
+     "src": 0, "dac": "hw", "address": 98, "headless": true,
+     "regions": [{"name": "b", "coordinates": [400, 60, 460, 300]}]}
+Options given on the command line take precedence over the config.
+The checkpoint file is named after the title unless set, null in the
+ config turns it off. A calibration file is only used if given, or on
+ --resume, where it is named after the title too. Loading one skips
+ calibration and opens the valve to the saved volts without a '0'.
+
+--unattended starts calibrating at once, asks for no notes and uses
+ the external DAC if connected, else a simulated one, without asking.
+
+Usage:
+    python vision_code_6.py [--config FILE] [--unattended] [--split]
+                            [--title T] [--user U] [--viscosity V]
+                            [--spd S] [--volts V] [--src SRC]
+                            [--dac {sim,hw,auto}] [--address A] ...
+"""
+import argparse
+import json
+import time
+
+TITLE = "ASS_v5"
+
+
+def source(value):
+    """Return camera index for digits, else a video file path."""
+    return int(value) if value.isdigit() else value
+
+
+def parse(argv=None):
+    """Read options from the command line and config file.
+
+    Returns: (split, Experiment keyword arguments dict)
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     argument_default=argparse.SUPPRESS)
+    parser.add_argument('--config', metavar='FILE',
+                        help="JSON file of Experiment options")
+    parser.add_argument('--unattended', action='store_true',
+                        help="never wait for a person")
+    parser.add_argument('--split', action='store_true',
+                        help="run vision and control in separate processes")
+    parser.add_argument('--title')
+    parser.add_argument('--user')
+    parser.add_argument('--viscosity', type=float)
+    parser.add_argument('--spd', type=float, help="seconds per drop")
+    parser.add_argument('--volts', type=int, help="initial optimal volts")
+    parser.add_argument('--src', type=source,
+                        help="camera index or video file")
+    parser.add_argument('--dac', choices=('sim', 'hw', 'auto'))
+    parser.add_argument('--address', type=lambda value: int(value, 0),
+                        help="DAC I2C address, e.g. 0x62")
+    parser.add_argument('--roi', dest='coordinates', type=int, nargs=4,
+                        metavar=('WEST', 'NORTH', 'EAST', 'SOUTH'))
+    parser.add_argument('--detector', choices=('mog2', 'diff'))
+    parser.add_argument('--scale', type=int,
+                        help="shrink the ROI N times before detection")
+    parser.add_argument('--channel', type=int, choices=(0, 1, 2),
+                        help="detect on one BGR channel")
+    parser.add_argument('--threaded', action='store_true',
+                        help="read frames on a thread of their own")
+    parser.add_argument('--headless', action='store_true',
+                        help="no window, keys are read from the terminal")
+    parser.add_argument('--display-every', type=int, metavar='N')
+    parser.add_argument('--noise-window', type=int, metavar='N')
+    parser.add_argument('--autostart', action='store_true',
+                        help="calibrate without waiting for '0'")
+    parser.add_argument('--no-notes', dest='interactive',
+                        action='store_false',
+                        help="do not ask for final notes")
+    parser.add_argument('--calibration', metavar='FILE',
+                        help="warm start from FILE if it exists, save to it")
+    parser.add_argument('--checkpoint', metavar='FILE')
+    parser.add_argument('--resume', action='store_true',
+                        help="continue the experiment of the checkpoint")
+    parser.add_argument('--clips', metavar='DIR')
+    parser.add_argument('--telemetry', type=int, metavar='PORT')
+    parser.add_argument('--telemetry-host', metavar='HOST')
+    parser.add_argument('--profile', action='store_true')
+    args = vars(parser.parse_args(argv))
+
+    options = {}
+    if 'config' in args:
+        with open(args.pop('config')) as config:
+            options = json.load(config)
+    split = args.pop('split', options.pop('split', False))
+    unattended = args.pop('unattended', options.pop('unattended', False))
+    options.update(args)
+
+    options.setdefault('title', TITLE)
+    if unattended:
+        options.setdefault('autostart', True)
+        options.setdefault('interactive', False)
+        options.setdefault('dac', 'auto')
+    if split:
+        for key in ('calibration', 'checkpoint', 'resume', 'clips',
+                    'auto_roi'):
+            if options.get(key):
+                parser.error("{} needs a single process, drop --split"
+                             .format(key))
+            options.pop(key, None)
+    else:
+        if options.get('resume'):
+            options.setdefault('calibration',
+                               options['title'] + "_calibration.npz")
+        options.setdefault('checkpoint',
+                           options['title'] + "_checkpoint.npz")
+    return split, options
+
+
+def main(started=None, argv=None):
+    """Run the experiment the options describe until it ends.
+
+    started is the time.monotonic() the program started at, by default
+     now. It should be taken before any heavy import.
+    """
+    started = time.monotonic() if started is None else started
+    split, options = parse(argv)
+
+    if split:
+        from .split import SplitExperiment as Experiment
+    else:
+        from .experiment import Experiment
+    Experiment(started=started, **options).main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+import os
+import queue
+import threading
+import time
+
+
+class ExperimentLog():
+    """Streaming, Append-only Experiment Log.
+
+    Writes drop rows to <filename>.txt and noise rows to
+     <filename>_Noise.txt as they arrive, instead of all at the end.
+    Rows are formatted and written in batches on a background thread,
+     flushed after every batch and fsync'd every [sync] seconds.
+    A crash therefore loses at most the last few seconds of data.
+
+    Layout is unchanged: header, tab-separated drop rows, footer
+     in the drop file and tab-separated noise rows in the noise file.
+    """
+
+    DROP_ROW = "{0}\t{1}\t{2}\t{3}\t{4}\t{5}\n"
+    NOISE_ROW = "{0}\t{1}\n"
+
+    def __init__(self, filename, header, append=False, batch=512, sync=5):
+        """Open both log files and start writer thread.
+
+        header: text written at the top of the drop file.
+        append: continue existing files, header is not written.
+        """
+        mode = "a" if append else "w"
+        self.__drop_file = open(filename + ".txt", mode)
+        self.__noise_file = open(filename + "_Noise.txt", mode)
+
+        self.__queue = queue.SimpleQueue()
+        self.__batch = batch
+        self.__sync = sync
+        self.__synced = time.monotonic()
+        self.closed = False
+
+        if not append:
+            self.__queue.put((self.__drop_file, header))
+
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def drop(self, row):
+        """Queue drop row for writing."""
+        self.__queue.put((self.__drop_file, row))
+
+    def noise(self, row):
+        """Queue noise row for writing."""
+        self.__queue.put((self.__noise_file, row))
+
+    def text(self, text):
+        """Queue plain text, e.g. notes, for the drop file."""
+        self.__queue.put((self.__drop_file, text))
+
+    def close(self, footer=None):
+        """Write footer if given, flush everything to disk, close files.
+
+        Safe to call more than once.
+        """
+        if self.closed:
+            return
+        self.closed = True
+
+        if footer is not None:
+            self.text(footer)
+        self.__queue.put(None)
+        self.__thread.join()
+
+        for log_file in (self.__drop_file, self.__noise_file):
+            log_file.flush()
+            os.fsync(log_file.fileno())
+            log_file.close()
+
+    def __run(self):
+        """Write queued rows in batches until closed."""
+        running = True
+        while running:
+            batch = [self.__queue.get()]
+            while len(batch) < self.__batch:
+                try:
+                    batch.append(self.__queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for item in batch:
+                if item is None:
+                    running = False
+                    break
+                log_file, row = item
+                if isinstance(row, str):
+                    log_file.write(row)
+                elif log_file is self.__drop_file:
+                    log_file.write(self.DROP_ROW.format(*row))
+                else:
+                    log_file.write(self.NOISE_ROW.format(*row))
+
+            self.__flush()
+
+    def __flush(self):
+        """Hand written rows to the OS. Periodically force them to disk."""
+        self.__drop_file.flush()
+        self.__noise_file.flush()
+
+        if time.monotonic() - self.__synced > self.__sync:
+            os.fsync(self.__drop_file.fileno())
+            os.fsync(self.__noise_file.fileno())
+            self.__synced = time.monotonic()
@@ -1,4 +1,15 @@
-import time
+from .clock import Clock
+from .history import History
+from .profiler import Profiler
+from .stats import NoiseStats
+
+DROP_FIELDS = [('time', 'f8'),
+               ('time_since_drop', 'f8'),
+               ('frame', 'i8'),
+               ('noise_average', 'f8'),
+               ('noise', 'i4'),
+               ('volts', 'f8'),
+               ]
 
 
 class Model():
@@ -13,26 +24,47 @@ class Model():
     def __init__(self, **kwargs):
         """Initialize virtualization of Physical Model.
 
-        All relevant drop/no-drop data is saved to lists
-         for later local storage.
+        Drop data is saved to a History store for later local storage.
+        It keeps up to [history] drops in memory, older drops
+         are spilled to a temporary file in [history_dir].
 
         Dop noise and no-drop noise are calculated each frame
          to prevent unnecessary list iterations.
-
-        Uses seconds per drop in **kwargs if given.
+        No-drop noise is not stored, only summed and fed to NoiseStats
+         following the last [noise_window] frames.
+        If noise_window is given the drop threshold scales with
+         the moving median noise, which follows lighting drift,
+         instead of the average noise since calibration.
+
+        Time is read from [clock], by default the wall clock.
+        If profile=True hot path stages are timed into a Profiler.
+         Being last in the MRO chain, Model sets the clock and profiler
+         for every other component.
+
+        Uses seconds per drop, history, history_dir, noise_window,
+         clock and profile in **kwargs if given.
         Passes kywd=arg pairs down MRO chain.
 
         TODO: Automate setting of seconds per drops
         """
+        self.clock = kwargs.pop('clock') if 'clock' in kwargs else Clock()
+        profile = kwargs.pop('profile') if 'profile' in kwargs else False
+        self.profiler = Profiler() if profile else None
+        self.seconds_per_drops = kwargs.pop('spd') if 'spd' in kwargs else 2
+        size = kwargs.pop('history') if 'history' in kwargs else 4096
+        directory = (kwargs.pop('history_dir') if 'history_dir' in kwargs
+                     else None)
+        self.noise_window = (kwargs.pop('noise_window')
+                             if 'noise_window' in kwargs else None)
         super().__init__(**kwargs)
 
-        self.last_drop_time = time.time()
+        self.last_drop_time = self.clock.time()
         self.drop_sum = 0
-        self.seconds_per_drops = kwargs.pop('spd') if 'spd' in kwargs else 2
-        self.drops = []
+        self.drops = History(DROP_FIELDS, size, directory)
 
-        self.noise = []
         self.noise_sum = 0
+        self.noise_frames = 0
+        self.noise_stats = NoiseStats(self.noise_window or 250)
 
         self.saturated = False
 
@@ -45,31 +77,93 @@ class Model():
         return -1
 
     def get_noise_average(self):
-        """Return average noise of no-drop frames. If none return -1."""
-        if len(self.noise) > 0:
-            return self.noise_sum / len(self.noise)
+        """Return average noise of no-drop frames. If none return -1.
+
+        Only frames since the last reset_noise() are averaged.
+        """
+        if self.noise_frames > 0:
+            return self.noise_sum / self.noise_frames
+        return -1
+
+    def get_noise_level(self):
+        """Return noise level drop thresholds scale with. If none return -1.
+
+        Moving median if noise_window is set, else the average noise.
+        """
+        if not self.noise_window:
+            return self.get_noise_average()
+        if self.noise_stats.count > 0:
+            return self.noise_stats.median
         return -1
 
     def add_noise(self, frame_no, noise):
         """Add noise data to class for averaging."""
         self.noise_sum += noise
-        self.noise.append((frame_no, noise))
+        self.noise_frames += 1
+        self.noise_stats.add(noise)
+
+    def get_noise_state(self):
+        """Return noise average and statistics as a list of numbers."""
+        return [self.noise_sum, self.noise_frames] + self.noise_stats.state()
+
+    def set_noise_state(self, state):
+        """Carry on from noise state returned by get_noise_state()."""
+        self.noise_sum = state[0]
+        self.noise_frames = int(state[1])
+        self.noise_stats.restore(state[2:])
 
-    def add_drop(self, frame_no, noise, beginning, volts):
+    def get_model_state(self):
+        """Return everything the model has learnt so far (dict).
+
+        Drop rows are already streamed to the log, so only their count
+         and the last row are kept. Costs the same however many drops.
+        """
+        return {'drop_sum': self.drop_sum,
+                'drop_count': len(self.drops),
+                'last_drop': self.drops.window()[-1:].copy(),
+                'noise': self.get_noise_state(),
+                'saturated': self.saturated,
+                }
+
+    def set_model_state(self, state):
+        """Carry on from state returned by get_model_state().
+
+        Time since the last drop is counted from now,
+         so time the model was not running is not taken for it.
+        """
+        self.last_drop_time = self.clock.time()
+        self.drop_sum = state['drop_sum'].item()
+        last_drop = state['last_drop'].tolist()
+        self.drops.skip(int(state['drop_count']) - len(last_drop))
+        for row in last_drop:
+            self.drops.append(row)
+        self.set_noise_state(list(state['noise']))
+        self.saturated = bool(state['saturated'])
+
+    def reset_noise(self):
+        """Start noise statistics over, e.g. after the ROI changed."""
+        self.noise_sum = 0
+        self.noise_frames = 0
+        self.noise_stats = NoiseStats(self.noise_stats.window)
+
+    def add_drop(self, frame_no, noise, beginning, volts, timestamp=None):
         """Add drop data to history.
 
         Data includes: time since beginning,
          time since last drop, frame number,
          current noise average, frame's noise,
          and current volts.
+
+        Timestamp is the time the drop was seen, defaults to now.
         """
-        self.drops.append([time.time() - beginning,
-                           time.time() - self.last_drop_time,
+        now = self.clock.time() if timestamp is None else timestamp
+        self.drops.append((now - beginning,
+                           now - self.last_drop_time,
                            frame_no,
-                           self.noise_sum / len(self.noise),
+                           self.get_noise_average(),
                            noise,
                            volts,
-                           ])
+                           ))
         self.drop_sum += noise
 
-        self.last_drop_time = time.time()
+        self.last_drop_time = now
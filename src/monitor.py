@@ -1,6 +1,14 @@
+import collections
+import threading
+import time
+
 import cv2
+import numpy as np
 
+from .detector import create_detector
+from .recorder import ClipRecorder
 from .roi import ROI
+from .terminal import KeyReader
 
 
 class Monitor(ROI):
@@ -19,31 +27,119 @@ class Monitor(ROI):
          1 for USB camera
          cv2.samples.findFileOrKeep(<FILEPATH>) for a file
 
-        Required background subtractor parameters are:
-         [history, varThreshold, detectShadows]
-        Tweaking may be necessary for optimal results.
-
-        More on background subtraction methods at
-        https://docs.opencv.org/4.5.0/de/de1/group__video__motion.html
-
-        Uses source in **kwargs if given.
+        Moving pixels are found by [detector], 'mog2' by default
+         or 'diff' for a cheaper frame difference. See detector.py.
+        Each region of the ROI has a detector of its own.
+
+        If threaded=True frames are read by a FrameGrabber thread.
+         Only the newest frame is processed, older ones are skipped.
+        queue_size sets how many frames the grabber may hold.
+
+        If headless=True no window is opened or drawn on.
+         Keyboard commands are read from the terminal instead.
+         Setting hold_keys leaves the terminal alone, e.g. for a prompt.
+        display_every=N only draws and shows every Nth frame.
+
+        scale=N shrinks the ROI N times in each direction before detection.
+        channel=0, 1 or 2 detects on that BGR channel instead of grayscale.
+         See prepare_roi.
+
+        If auto_roi is set, motion over the whole frame is summed
+         into a MotionHeatmap while calibrating, to propose the smallest
+         ROI holding the drip path. See propose_roi.
+         auto_roi=True applies the proposal itself, 'ask' waits for 'F'.
+
+        If clips is a directory, the ROI frames around events are
+         recorded there as short videos by a ClipRecorder.
+         clip_frames=(before, after) sets how many frames around it,
+         clip_budget how many bytes the frames may take up.
+         Frames are kept at the size of the ROI at start, see union(),
+         a larger ROI later on is cut to it.
+
+        If replay=True the source is a recorded video run as fast
+         as possible. Frame times come from the video's frame rate
+         and drive the experiment's clock, which must be a FrameClock.
+         EndOfStream is raised once the video runs out.
+
+        Uses source, threaded, queue_size, headless, display_every,
+         scale, channel, replay, detector, auto_roi, clips,
+         clip_frames and clip_budget in **kwargs if given.
         Passes kywd=arg pairs down MRO chain.
         """
+        src = kwargs.pop('src') if 'src' in kwargs else 0
+        threaded = kwargs.pop('threaded') if 'threaded' in kwargs else False
+        queue_size = kwargs.pop('queue_size') if 'queue_size' in kwargs else 2
+        headless = kwargs.pop('headless') if 'headless' in kwargs else False
+        every = (kwargs.pop('display_every') if 'display_every' in kwargs
+                 else 1)
+        scale = kwargs.pop('scale') if 'scale' in kwargs else 1
+        channel = kwargs.pop('channel') if 'channel' in kwargs else None
+        replay = kwargs.pop('replay') if 'replay' in kwargs else False
+        detector = kwargs.pop('detector') if 'detector' in kwargs else 'mog2'
+        auto_roi = kwargs.pop('auto_roi') if 'auto_roi' in kwargs else False
+        clips = kwargs.pop('clips') if 'clips' in kwargs else None
+        clip_frames = (kwargs.pop('clip_frames') if 'clip_frames' in kwargs
+                       else (30, 15))
+        clip_budget = (kwargs.pop('clip_budget') if 'clip_budget' in kwargs
+                       else 64 << 20)
         super().__init__(**kwargs)
 
-        src = kwargs.pop('src') if 'src' in kwargs else 0
         self.__capture = cv2.VideoCapture(src)
-        if not self.__capture.isOpened:
+        if not self.__capture.isOpened():
             raise Exception("Unable to open {}".format(src))
 
         self.__frame = None
         self.frame_no = 0
+        self.frame_time = self.clock.time()
+        self.frame_stamp = time.monotonic()
+        self.capture_no = 0
+        self.frames_skipped = 0
         self.__roi_frame = None
-        self.__backSub = cv2.createBackgroundSubtractorMOG2(40, 60, False)
+        self.detectors = {name: create_detector(detector)
+                          for name in self.regions}
+        self.detector = self.detectors['main']
+        self.region_noise = dict.fromkeys(self.regions, 0)
+        self.masks = {}
+        self.__union = self.union()
+        self.scale = scale
+        self.channel = channel
 
         bounds = (int(self.__capture.get(4)), int(self.__capture.get(3)))
+        self.bounds = bounds
         self.set_bounds(bounds)
 
+        self.auto_roi = auto_roi
+        self.heatmap = MotionHeatmap() if auto_roi else None
+        self.proposed_roi = None
+
+        self.replay = replay
+        self.__start = self.frame_time
+        self.__fps = self.__capture.get(cv2.CAP_PROP_FPS) or 30
+
+        self.recorder = None
+        if clips:
+            west, north, east, south = self.union()
+            self.recorder = ClipRecorder(clips,
+                                         (south - north, east - west, 3),
+                                         *clip_frames, budget=clip_budget,
+                                         fps=self.__fps)
+
+        self.__grabber = None
+        if threaded and not replay:
+            self.__grabber = FrameGrabber(self.__capture, queue_size)
+
+        self.headless = headless
+        self.display_every = max(1, int(every))
+        self.__delay = 30 if self.display_every == 1 and not replay else 1
+        self.__display = not headless
+        self.__shown = 0
+        self.__keys = None
+        self.hold_keys = False
+        if headless:
+            self.__keys = KeyReader()
+        else:
+            cv2.namedWindow('Frame', cv2.WINDOW_NORMAL)
+
         print(":: MONITOR INITIALIZED ::\n")
 
     def get_frame(self):
@@ -52,14 +148,54 @@ class Monitor(ROI):
         Draw rectangle around region of interest on each frame.
         If next frame not found raise Exception.
 
+        frame_time is the clock time the frame was captured at.
+        frame_stamp is the same moment on time.monotonic().
+        When threaded it is back-dated by the age of the frame.
+        When replaying it is the frame's position in the video.
+
         Returns: OpenCV frame (numerical array)
         """
-        __, self.__frame = self.__capture.read()
+        profiler = self.profiler
+        if profiler:
+            mark = profiler.start()
+
+        if self.__grabber:
+            stamp, self.__frame, self.capture_no, skipped = \
+                self.__grabber.read()
+            self.frames_skipped += skipped
+        else:
+            __, self.__frame = self.__capture.read()
+            stamp = time.monotonic()
+            self.capture_no += 1
 
         if self.__frame is None:
+            if self.replay:
+                raise EndOfStream("End of video after {} frames."
+                                  .format(self.capture_no - 1))
             raise Exception("Camera error! Next frame not found.")
 
+        if self.replay:
+            self.frame_time = (self.__start
+                               + (self.capture_no - 1) / self.__fps)
+            self.clock.set(self.frame_time)
+        else:
+            self.frame_time = self.clock.time() - (time.monotonic() - stamp)
+        self.frame_stamp = stamp
+
+        if not self.headless:
+            self.__display = self.__shown % self.display_every == 0
+            self.__shown += 1
+
+        if profiler:
+            mark = profiler.stop('read', mark)
         self.__draw_rectangle()
+        if profiler:
+            mark = profiler.stop('rectangle', mark)
+
+        if self.recorder:
+            self.recorder.add(self.__roi_frame)
+            if profiler:
+                profiler.stop('record', mark)
 
         return self.__frame
 
@@ -68,66 +204,363 @@ class Monitor(ROI):
 
         Shows each frame for 30ms (~30 FPS),
          or until a key is pressed.
+        When only every Nth frame is shown waits 1ms instead,
+         skipped frames return immediately.
+        When headless polls the terminal for a key instead.
 
-        Returns: ASCII value of key pressed (int)
+        Returns: ASCII value of key pressed, 0xFF if none (int)
         """
-        cv2.namedWindow('Frame', cv2.WINDOW_NORMAL)
+        if self.headless:
+            return 0xFF if self.hold_keys else self.__keys.read()
+        if not self.__display:
+            return 0xFF
+
+        profiler = self.profiler
+        if profiler:
+            mark = profiler.start()
+
         cv2.imshow('Frame', self.__frame)
+        key = cv2.waitKey(self.__delay) & 0xFF
 
-        return cv2.waitKey(30) & 0xFF
+        if profiler:
+            profiler.stop('show', mark)
+        return key
 
     def image_processing(self):
         """Process image to capture moving pixels.
 
         Crop image to region of interest (ROI), then convert to grayscale.
-        After that use background subtraction on ROI.
+        After that use the detector's background subtraction on ROI.
+        Overlays are only drawn on frames that will be shown.
+
+        With several regions the crop and conversion are done once,
+         on the rectangle holding them all. Each region's part of it
+         then goes through that region's own detector.
+        Moving pixels of every region are kept in region_noise,
+         (foreground mask, full resolution shape) of each in masks.
+
+        When the ROI is downscaled the moving pixel count is scaled
+         back up to full resolution pixels,
+         so noise thresholds keep their meaning.
 
         TODO: Better variable names
 
-        Returns: Amount of pixels detected to have moved (int)
+        Returns: Amount of pixels detected to have moved in the ROI (int)
         """
-        west, north, east, south = self._coordinates
-
-        gray = cv2.cvtColor(self.__roi_frame, cv2.COLOR_BGR2GRAY)
-        fg_mask = self.__backSub.apply(gray)
-        fg_mask_rgb = cv2.cvtColor(fg_mask, cv2.COLOR_GRAY2RGB)
-
-        cv2.rectangle(self.__frame,
-                      (10, 2),
-                      (100, 20),
-                      (0, 0, 0),
-                      -1
-                      )
-        cv2.putText(self.__frame,
-                    str(self.__capture.get(cv2.CAP_PROP_POS_FRAMES)),
-                    (15, 15),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.5,
-                    (255, 255, 255)
-                    )
-
-        self.__frame[north: south, west: east] = fg_mask_rgb
-        noise = cv2.countNonZero(fg_mask)
+        profiler = self.profiler
+        if profiler:
+            mark = profiler.start()
+
+        if self.heatmap:
+            self.heatmap.add(self.__frame)
+            if profiler:
+                mark = profiler.stop('heatmap', mark)
+
+        gray = prepare_roi(self.__roi_frame, self.scale, self.channel)
+        if profiler:
+            mark = profiler.stop('prepare', mark)
+
+        masks = {}
+        for name, coordinates in self.regions.items():
+            crop, shape = self.__crop(gray, coordinates)
+            if crop.size:
+                masks[name] = self.detectors[name].apply(crop)
+                self.region_noise[name] = count_moving(masks[name], shape)
+                self.masks[name] = (masks[name], shape)
+            else:
+                self.region_noise[name] = 0
+                self.masks.pop(name, None)
+        if profiler:
+            mark = profiler.stop('subtract', mark)
+
+        if self.__display:
+            for name, fg_mask in masks.items():
+                west, north, east, south = self.regions[name]
+                if fg_mask.shape != (south - north, east - west):
+                    fg_mask = cv2.resize(fg_mask,
+                                         (east - west, south - north),
+                                         interpolation=cv2.INTER_NEAREST
+                                         )
+                fg_mask_rgb = cv2.cvtColor(fg_mask, cv2.COLOR_GRAY2RGB)
+                self.__frame[north: south, west: east] = fg_mask_rgb
+
+            cv2.rectangle(self.__frame,
+                          (10, 2),
+                          (100, 20),
+                          (0, 0, 0),
+                          -1
+                          )
+            cv2.putText(self.__frame,
+                        str(self.capture_no),
+                        (15, 15),
+                        cv2.FONT_HERSHEY_SIMPLEX,
+                        0.5,
+                        (255, 255, 255)
+                        )
+            if profiler:
+                profiler.stop('overlay', mark)
 
         self.frame_no += 1
-        return noise
+        return self.region_noise['main']
+
+    def roi_frame(self):
+        """Return crop of the current frame holding every region."""
+        return self.__roi_frame
+
+    def propose_roi(self):
+        """Propose ROI around the motion summed in the heatmap.
+
+        Summing stops here, the heatmap is not needed anymore.
+
+        Returns: [west, north, east, south], None if nothing moved
+        """
+        self.proposed_roi = self.heatmap.propose()
+        self.heatmap = None
+        if self.proposed_roi:
+            print("Proposed ROI: ({0}, {1}), ({2}, {3})"
+                  .format(*self.proposed_roi)
+                  )
+        else:
+            print("No motion found to propose an ROI from.")
+        return self.proposed_roi
+
+    def apply_roi(self):
+        """Move the ROI to the proposed ROI, if any.
+
+        Detector background of the old ROI is thrown away.
+
+        Returns: True if the ROI was moved, else False
+        """
+        if not self.proposed_roi:
+            return False
+
+        self.set_region(self.proposed_roi)
+        self.proposed_roi = None
+        self.detector.reset()
+        print("Coordinates: ({0}, {1}), ({2}, {3})"
+              .format(*self._coordinates)
+              )
+        return True
 
     def shutoff_vision(self):
         """Release camera interface. Destroy any associated windows."""
         print("Shutting off vision...")
+        if self.__grabber:
+            self.__grabber.stop()
+        if self.recorder:
+            self.recorder.stop()
         self.__capture.release()
-        cv2.destroyAllWindows()
+        if self.headless:
+            self.__keys.restore()
+        else:
+            cv2.destroyAllWindows()
         print("Vision released.\n")
 
     def __draw_rectangle(self):
-        """Draw rectangle around ROI. Crop for later processing."""
-        west, north, east, south = self._coordinates
-
-        self.__frame = cv2.rectangle(self.__frame,
-                                     (west, north),
-                                     (east, south),
-                                     (100, 50, 200),
-                                     2,
-                                     )
+        """Draw rectangle around each region. Crop for later processing.
 
+        Rectangle border overlaps the ROI, so it is drawn on every frame
+         unless headless to keep the ROI's edge pixels consistent.
+        The crop holds every region.
+        """
+        if not self.headless:
+            for name, (west, north, east, south) in self.regions.items():
+                self.__frame = cv2.rectangle(self.__frame,
+                                             (west, north),
+                                             (east, south),
+                                             (100, 50, 200) if name == 'main'
+                                             else (200, 100, 50),
+                                             2,
+                                             )
+
+        self.__union = west, north, east, south = self.union()
         self.__roi_frame = self.__frame[north: south, west: east]
+
+    def __crop(self, image, coordinates):
+        """Cut a region out of the prepared crop of every region.
+
+        image may be scaled down from the crop,
+         so coordinates are scaled to match.
+
+        Returns: (region image, full resolution region shape)
+        """
+        west, north, east, south = self.__union
+        height, width = image.shape[:2]
+        y_scale = height / max(1, south - north)
+        x_scale = width / max(1, east - west)
+
+        top = round((coordinates[1] - north) * y_scale)
+        bottom = round((coordinates[3] - north) * y_scale)
+        left = round((coordinates[0] - west) * x_scale)
+        right = round((coordinates[2] - west) * x_scale)
+
+        shape = (coordinates[3] - coordinates[1],
+                 coordinates[2] - coordinates[0])
+        return image[top: bottom, left: right], shape
+
+
+class EndOfStream(Exception):
+    """Raised when a replayed video has no frames left."""
+
+
+def prepare_roi(roi, scale=1, channel=None):
+    """Reduce a BGR ROI crop to the single channel image detection runs on.
+
+    channel: None converts to grayscale.
+     0, 1 or 2 takes that BGR channel directly, skipping the conversion.
+    scale: shrink factor in each direction, 1 keeps full resolution.
+     Area interpolation averages pixels so small noise is smoothed out.
+
+    Returns: single channel image (numerical array)
+    """
+    if channel is None:
+        image = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+    else:
+        image = cv2.extractChannel(roi, channel)
+
+    if scale > 1:
+        height, width = image.shape
+        size = (max(1, round(width / scale)), max(1, round(height / scale)))
+        image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+    return image
+
+
+def count_moving(fg_mask, shape):
+    """Count moving pixels of a mask in full resolution units.
+
+    shape: shape of the full resolution ROI the mask was made from.
+
+    Returns: Amount of pixels detected to have moved (int)
+    """
+    noise = cv2.countNonZero(fg_mask)
+    if fg_mask.shape != tuple(shape[:2]):
+        noise = int(round(noise * shape[0] * shape[1] / fg_mask.size))
+    return noise
+
+
+class MotionHeatmap():
+    """Whole Frame Motion Accumulator.
+
+    Counts how often each pixel changes between frames.
+    Frames are shrunk [scale] times first, so summing stays cheap.
+    The drip path lights up, and can then be boxed in by propose().
+    """
+
+    def __init__(self, scale=4, threshold=25):
+        """Start empty heatmap.
+
+        threshold: change in brightness that counts as motion.
+        """
+        self.scale = scale
+        self.threshold = threshold
+        self.frames = 0
+        self.__shape = None
+        self.__previous = None
+        self.__heat = None
+
+    def add(self, frame):
+        """Count pixels of BGR [frame] that moved since the last one."""
+        gray = prepare_roi(frame, self.scale)
+        if self.__previous is None:
+            self.__shape = frame.shape[:2]
+            self.__heat = np.zeros(gray.shape, np.uint32)
+        else:
+            self.__heat += cv2.absdiff(gray, self.__previous) > self.threshold
+        self.__previous = gray
+        self.frames += 1
+
+    def propose(self, fraction=0.1, margin=10):
+        """Return tightest rectangle around the hot part of the heatmap.
+
+        Pixels moving at least [fraction] as often as the hottest one
+         are hot, pixels that moved only once are ignored as noise.
+        The rectangle is grown by [margin] pixels on each side.
+
+        Returns: [west, north, east, south] in full frame pixels,
+         None if nothing moved
+        """
+        if self.__heat is None or not self.__heat.any():
+            return None
+
+        hot = self.__heat >= max(2, self.__heat.max() * fraction)
+        rows = np.flatnonzero(hot.any(axis=1))
+        columns = np.flatnonzero(hot.any(axis=0))
+        if not len(rows):
+            return None
+
+        height, width = self.__shape
+        y_scale = height / self.__heat.shape[0]
+        x_scale = width / self.__heat.shape[1]
+        return [max(0, int(columns[0] * x_scale) - margin),
+                max(0, int(rows[0] * y_scale) - margin),
+                min(width, int((columns[-1] + 1) * x_scale + 0.5) + margin),
+                min(height, int((rows[-1] + 1) * y_scale + 0.5) + margin),
+                ]
+
+
+class FrameGrabber():
+    """Threaded Camera Reader.
+
+    Reads frames from a capture on a dedicated thread so that camera
+     decoding does not wait on processing and vice versa.
+
+    Frames are held in a bounded queue, oldest frames are dropped first.
+    Each frame is stamped with time.monotonic() when read.
+    """
+
+    def __init__(self, capture, size=2):
+        """Start reader thread on an opened cv2.VideoCapture."""
+        self.__capture = capture
+        self.__frames = collections.deque(maxlen=max(1, size))
+        self.__ready = threading.Condition()
+        self.__running = True
+
+        self.captured = 0
+        self.skipped = 0
+
+        self.__thread = threading.Thread(target=self.__update, daemon=True)
+        self.__thread.start()
+
+    def read(self, timeout=1.0):
+        """Return newest frame, discarding any older queued frames.
+
+        Waits up to [timeout] seconds for a frame to arrive.
+
+        Returns: (monotonic stamp, frame, capture number, frames skipped)
+         Frame is None if the camera stopped delivering frames.
+        """
+        with self.__ready:
+            self.__ready.wait_for(lambda: self.__frames
+                                  or not self.__running, timeout)
+            if not self.__frames:
+                return time.monotonic(), None, self.captured, 0
+
+            stamp, frame, number = self.__frames.pop()
+            skipped = len(self.__frames) + self.skipped
+            self.__frames.clear()
+            self.skipped = 0
+
+        return stamp, frame, number, skipped
+
+    def stop(self):
+        """Stop reader thread. Capture is left for the owner to release."""
+        self.__running = False
+        self.__thread.join()
+
+    def __update(self):
+        """Read frames until stopped or the camera runs out of frames."""
+        while self.__running:
+            grabbed, frame = self.__capture.read()
+            stamp = time.monotonic()
+
+            with self.__ready:
+                if not grabbed:
+                    self.__running = False
+                elif len(self.__frames) == self.__frames.maxlen:
+                    self.skipped += 1
+
+                if grabbed:
+                    self.captured += 1
+                    self.__frames.append((stamp, frame, self.captured))
+                self.__ready.notify_all()
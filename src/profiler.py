@@ -0,0 +1,98 @@
+import bisect
+import time
+
+
+class Histogram():
+    """Fixed Bucket Latency Histogram.
+
+    Buckets are spaced 4 per octave from 1us to ~17min,
+     so any percentile is accurate to within ~19%.
+    Adding a sample is a bisect and an increment, nothing is stored.
+    """
+
+    BUCKETS = [1e-6 * 2 ** (step / 4) for step in range(120)]
+
+    def __init__(self):
+        """Create empty histogram."""
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, seconds):
+        """Add sample of [seconds] to its bucket."""
+        self.counts[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, percent):
+        """Return upper bound of the bucket holding [percent]% of samples.
+
+        If no samples return 0.
+        """
+        rank = self.count * percent / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                if index == len(self.BUCKETS):
+                    return self.max
+                return min(self.BUCKETS[index], self.max)
+        return 0
+
+
+class Profiler():
+    """Per-stage Hot Path Profiler.
+
+    Stages are timed by taking a start mark and stopping it:
+        mark = profiler.start()
+        ...
+        mark = profiler.stop('stage', mark)
+    stop() returns a new mark so consecutive stages can be chained.
+
+    Components hold profiler = None when profiling is off,
+     and only call it behind an if, so it costs nothing.
+    """
+
+    def __init__(self):
+        """Create profiler with no stages."""
+        self.stages = {}
+
+    def start(self):
+        """Return mark for the start of a stage."""
+        return time.perf_counter()
+
+    def stop(self, stage, mark):
+        """Record time since [mark] under [stage]. Return new mark."""
+        now = time.perf_counter()
+        self.record(stage, now - mark)
+        return now
+
+    def record(self, stage, seconds):
+        """Record a duration measured elsewhere under [stage]."""
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram()
+        histogram.add(seconds)
+
+    def report(self, end="\n"):
+        """Return one line per stage with count, mean, p50/p95/p99 and max.
+
+        Times are in milliseconds. Each line is ended with [end].
+        """
+        lines = []
+        for stage, histogram in self.stages.items():
+            lines.append("Profile {0}: n={1} mean={2:.3f} p50={3:.3f} "
+                         "p95={4:.3f} p99={5:.3f} max={6:.3f} ms{7}".format(
+                             stage,
+                             histogram.count,
+                             histogram.total / histogram.count * 1000,
+                             histogram.percentile(50) * 1000,
+                             histogram.percentile(95) * 1000,
+                             histogram.percentile(99) * 1000,
+                             histogram.max * 1000,
+                             end,
+                             ))
+        return "".join(lines)
@@ -0,0 +1,160 @@
+import collections
+import os
+import queue
+import threading
+
+import cv2
+import numpy as np
+
+
+class ClipRecorder():
+    """Event Clip Recorder.
+
+    Keeps the last [before] ROI frames, and on an event such as a drop
+     writes them and the next [after] frames to a short video clip.
+    Clips are MJPG compressed and written on a background thread.
+
+    Frames are copied into slots of one pool of buffers allocated up
+     front, at most [budget] bytes, so recording never allocates frames.
+    Slots are shared by the ring of recent frames and any clips waiting
+     to be written, and only reused once neither needs them.
+    If every slot is taken frames are skipped, counted in skipped.
+
+    An event while a clip still collects its [after] frames extends that
+     clip, counted in merged, so one event of many frames makes one clip.
+    A clip is only as long as the pool allows. If every slot is taken
+     while it collects, it is written as it is and carries on in a new
+     clip, [name]_2 and so on, once slots are freed.
+    """
+
+    def __init__(self, directory, shape, before=30, after=15,
+                 budget=64 << 20, fps=30):
+        """Allocate pool for frames up to [shape] (height, width, 3).
+
+        Larger frames are cut to [shape].
+        At least before + after + 1 slots must fit in [budget].
+        """
+        self.directory = directory
+        self.before = before
+        self.after = after
+        self.fps = fps
+        self.skipped = 0
+        self.merged = 0
+        self.written = 0
+        os.makedirs(directory, exist_ok=True)
+
+        slots = int(budget // (np.prod(shape) or 1))
+        if slots < before + after + 1:
+            raise Exception("Clip budget of {} bytes is too small."
+                            .format(budget))
+        self.__pool = np.empty((slots,) + tuple(shape), dtype=np.uint8)
+        self.__sizes = np.zeros((slots, 2), dtype=np.int32)
+        self.__users = np.zeros(slots, dtype=np.int32)
+        self.__free = collections.deque(range(slots))
+        self.__ring = collections.deque()
+        self.__clips = []
+
+        self.__done = queue.SimpleQueue()
+        self.__queue = queue.SimpleQueue()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def add(self, frame):
+        """Copy [frame] into the pool as the newest frame."""
+        self.__release()
+        if len(self.__ring) == self.before:
+            self.__drop(self.__ring.popleft())
+        if not self.__free:
+            self.skipped += 1
+            self.__split()
+            return
+
+        slot = self.__free.popleft()
+        frame = frame[:self.__pool.shape[1], :self.__pool.shape[2]]
+        height, width = frame.shape[:2]
+        self.__pool[slot, :height, :width] = frame
+        self.__sizes[slot] = height, width
+        self.__users[slot] += 1
+        self.__ring.append(slot)
+
+        for clip in self.__clips:
+            self.__users[slot] += 1
+            clip[1].append(slot)
+        if self.__clips and len(self.__clips[0][1]) >= self.__clips[0][2]:
+            self.__queue.put(self.__clips.pop(0))
+
+    def trigger(self, name):
+        """Start clip [name] from the frames held, ending [after] later.
+
+        If a clip is still collecting, it ends [after] later instead.
+        """
+        if self.__clips:
+            clip = self.__clips[-1]
+            clip[2] = len(clip[1]) + self.after
+            self.merged += 1
+            return
+
+        slots = list(self.__ring)
+        for slot in slots:
+            self.__users[slot] += 1
+        self.__clips.append([name, slots, len(slots) + self.after, 1])
+
+    def stop(self):
+        """Write unfinished clips with the frames they have, then stop."""
+        for clip in self.__clips:
+            self.__queue.put(clip)
+        self.__clips = []
+        self.__queue.put(None)
+        self.__thread.join()
+        self.__release()
+
+    def __split(self):
+        """Write the collecting clip, the rest of it goes in a new one."""
+        if not self.__clips or not self.__clips[0][1]:
+            return
+        name, slots, end, part = self.__clips.pop(0)
+        self.__queue.put([name, slots, end, part])
+        self.__clips.insert(0, [name, [], end - len(slots), part + 1])
+
+    def __drop(self, slot):
+        """Stop using [slot]. Free it once nothing else uses it."""
+        self.__users[slot] -= 1
+        if not self.__users[slot]:
+            self.__free.append(slot)
+
+    def __release(self):
+        """Take back slots of clips that were written."""
+        while True:
+            try:
+                slots = self.__done.get_nowait()
+            except queue.Empty:
+                return
+            for slot in slots:
+                self.__drop(slot)
+
+    def __run(self):
+        """Write queued clips until stopped."""
+        while True:
+            clip = self.__queue.get()
+            if clip is None:
+                return
+            name, slots, __, part = clip
+            if part > 1:
+                name = "{}_{}".format(name, part)
+            if slots:
+                self.__write(name, slots)
+            self.__done.put(slots)
+
+    def __write(self, name, slots):
+        """Write frames in [slots] to <directory>/<name>.avi.
+
+        Frames are cut or padded to the size of the first one.
+        """
+        height, width = self.__sizes[slots[0]]
+        path = os.path.join(self.directory, name + ".avi")
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'),
+                                 self.fps, (int(width), int(height)))
+        for slot in slots:
+            writer.write(self.__pool[slot, :height, :width])
+        writer.release()
+        self.written += 1
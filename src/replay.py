@@ -0,0 +1,136 @@
+"""Replay a recorded video through the full control loop.
+
+The experiment runs on a FrameClock and a SimDac without bus latency or
+ write rate limit, headless and without prompts, as fast as frames can
+ be processed. Replaying the same video
+ with the same settings gives the same drop log, so a log from before a
+ detector or controller change can be compared against one from after.
+
+Usage:
+    python -m src.replay VIDEO [--title T] [--viscosity V] [--spd S]
+                               [--volts V] [--roi W N E S]
+                               [--auto-roi] [--noise-window N]
+                               [--calibration FILE] [--clips DIR]
+                               [--telemetry PORT] [--split]
+                               [--compare LOG]
+"""
+import argparse
+import os
+
+from .clock import FrameClock
+from .experiment import Experiment
+from .split import SplitExperiment
+from .valve import SimDac
+
+
+def replay(path, title='Replay', split=False, **kwargs):
+    """Run an Experiment over the video at [path] until it runs out.
+
+    Clock starts at the video file's modification time,
+     so repeated replays produce the same rows, under the same log
+     name numbered on, see Dripper.
+    If split=True a SplitExperiment runs vision in a process of its own.
+    Further kywd=arg pairs are passed to Experiment.
+
+    Returns: finished Experiment
+    """
+    options = {'src': path,
+               'replay': True,
+               'headless': True,
+               'autostart': True,
+               'interactive': False,
+               'clock': FrameClock(os.path.getmtime(path)),
+               'dac': SimDac(latency=0),
+               'dac_rate': 0,
+               }
+    options.update(kwargs)
+
+    experiment = (SplitExperiment if split else Experiment)(title, **options)
+    experiment.main()
+    return experiment
+
+
+def drop_rows(filename):
+    """Return the tab-separated drop rows of a drop log (list of str)."""
+    with open(filename) as log:
+        lines = log.read().split('\n')
+    return [line.strip() for line in lines
+            if line.count('\t') == 5 and 'TotalTime' not in line]
+
+
+def compare(expected, actual):
+    """Compare two lists of drop rows, as returned by drop_rows.
+
+    Returns: list of (row number, expected row, actual row) that differ
+    """
+    differences = []
+    for row in range(max(len(expected), len(actual))):
+        old = expected[row] if row < len(expected) else None
+        new = actual[row] if row < len(actual) else None
+        if old != new:
+            differences.append((row, old, new))
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('video')
+    parser.add_argument('--title', default='Replay')
+    parser.add_argument('--viscosity', type=float, default=50)
+    parser.add_argument('--spd', type=float, default=2)
+    parser.add_argument('--volts', type=int, default=45)
+    parser.add_argument('--roi', type=int, nargs=4,
+                        metavar=('WEST', 'NORTH', 'EAST', 'SOUTH'))
+    parser.add_argument('--auto-roi', action='store_true',
+                        help="fit the ROI to motion seen while calibrating")
+    parser.add_argument('--noise-window', type=int,
+                        help="scale drop threshold with the moving median"
+                             " noise of the last N frames")
+    parser.add_argument('--calibration', metavar='FILE',
+                        help="save calibration to FILE, warm start from it"
+                             " if it exists")
+    parser.add_argument('--clips', metavar='DIR',
+                        help="record clips of drops, ripples and clogs")
+    parser.add_argument('--telemetry', type=int, metavar='PORT',
+                        help="serve events and previews on localhost")
+    parser.add_argument('--split', action='store_true',
+                        help="run vision and control in separate processes")
+    parser.add_argument('--profile', action='store_true',
+                        help="time hot path stages into the log footer")
+    parser.add_argument('--compare', metavar='LOG',
+                        help="drop log of an earlier replay to compare with")
+    args = parser.parse_args()
+
+    expected = drop_rows(args.compare) if args.compare else None
+
+    options = {'viscosity': args.viscosity,
+               'spd': args.spd,
+               'volts': args.volts,
+               'profile': args.profile,
+               'noise_window': args.noise_window,
+               'telemetry': args.telemetry,
+               }
+    if args.roi:
+        options['coordinates'] = args.roi
+    if not args.split:
+        options.update(auto_roi=args.auto_roi,
+                       calibration=args.calibration,
+                       clips=args.clips,
+                       )
+    elif args.auto_roi or args.calibration or args.clips:
+        parser.error("--auto-roi, --calibration and --clips"
+                     " need a single process, drop --split")
+    experiment = replay(args.video, args.title, args.split, **options)
+
+    if args.compare:
+        differences = compare(expected,
+                              drop_rows(experiment.filename + ".txt"))
+        for row, old, new in differences[:10]:
+            print("Row {}:\n- {}\n+ {}".format(row, old, new))
+        print("{} of {} drop rows differ.".format(len(differences),
+                                                  len(expected)))
+        raise SystemExit(1 if differences else 0)
+
+
+if __name__ == '__main__':
+    main()
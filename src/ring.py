@@ -0,0 +1,204 @@
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+WRITTEN, READ, ENDED, STOPPED = range(4)
+
+
+class FrameRing():
+    """Shared Memory Frame Ring.
+
+    Hands each processed frame from one process to another: its capture
+     number, times, moving pixel count and foreground mask of every
+     region, key pressed, and ROI crop. Everything lives in one
+     multiprocessing.shared_memory block, so the reader takes noise
+     values without any frame copies.
+
+    One writer and one reader. A slot is marked busy while written and
+     numbered once done, then the write count is raised. The reader
+     checks the number after copying a record, so a slot overwritten
+     meanwhile is counted in lost instead of being read half written.
+
+    If block=True the writer waits for the reader rather than overwrite
+     frames not yet read, else the oldest frames are lost first.
+    Neither side locks, waiting is polling every POLL seconds.
+    """
+
+    POLL = 0.001
+
+    def __init__(self, shape, regions, slots=16, block=False, name=None):
+        """Make ring of [slots] frames of up to [shape] (height, width).
+
+        regions: how many noise values and masks each frame carries.
+         Masks are up to [shape] too.
+        name: shared memory of a ring made elsewhere to attach to.
+         The ring's own name is kept in name, to pass to the other side.
+        """
+        self.slots = slots
+        self.block = block
+        self.read = 0
+        self.lost = 0
+
+        self.dtype = np.dtype([('seq', 'i8'),
+                               ('capture', 'i8'),
+                               ('time', 'f8'),
+                               ('stamp', 'f8'),
+                               ('skipped', 'i8'),
+                               ('key', 'i4'),
+                               ('height', 'i4'),
+                               ('width', 'i4'),
+                               ('noise', 'i8', (regions,)),
+                               ('mask_size', 'i4', (regions, 2)),
+                               ('mask_shape', 'i4', (regions, 2)),
+                               ])
+        header = 4 * 8
+        records = slots * self.dtype.itemsize
+        frames = (slots,) + tuple(shape[:2]) + (3,)
+        masks = (slots, regions) + tuple(shape[:2])
+        size = (header + records + int(np.prod(frames))
+                + int(np.prod(masks)))
+
+        if name:
+            self.__memory = attach(name)
+        else:
+            self.__memory = shared_memory.SharedMemory(create=True,
+                                                       size=size)
+        self.name = self.__memory.name
+
+        buffer = self.__memory.buf
+        self.__header = np.ndarray(4, np.int64, buffer)
+        self.__records = np.ndarray(slots, self.dtype, buffer, header)
+        self.__frames = np.ndarray(frames, np.uint8, buffer,
+                                   header + records)
+        self.__masks = np.ndarray(masks, np.uint8, buffer,
+                                  header + records + int(np.prod(frames)))
+        if not name:
+            self.__header[:] = 0
+            self.__records['seq'] = 0
+
+    def put(self, capture, frame_time, stamp, noise, key, skipped, roi,
+            masks):
+        """Write one frame's values and [roi] crop as the newest record.
+
+        masks: (foreground mask, full resolution shape) of each region,
+         None for a region without one.
+
+        Returns: False once the reader asked to stop, else True
+        """
+        header = self.__header
+        written = int(header[WRITTEN])
+        while (self.block and not header[STOPPED]
+               and written - header[READ] >= self.slots):
+            time.sleep(self.POLL)
+        if header[STOPPED]:
+            return False
+
+        slot = written % self.slots
+        height, width = roi.shape[:2]
+        sizes = [(0, 0)] * len(masks)
+        shapes = [(0, 0)] * len(masks)
+        self.__records['seq'][slot] = -1
+        for index, mask in enumerate(masks):
+            if mask is not None:
+                fg_mask, shapes[index] = mask
+                sizes[index] = fg_mask.shape
+                self.__masks[slot, index, :sizes[index][0],
+                             :sizes[index][1]] = fg_mask
+        self.__records[slot] = (-1, capture, frame_time, stamp, skipped, key,
+                                height, width, noise, sizes, shapes)
+        self.__frames[slot, :height, :width] = roi
+        self.__records['seq'][slot] = written + 1
+        header[WRITTEN] = written + 1
+        return True
+
+    def get(self, timeout=1.0):
+        """Return the oldest record not yet read (numpy.void).
+
+        Frames overwritten before they were read are skipped,
+         counted in lost.
+        The record returned is held until the next get(),
+         so its frame() is not overwritten while blocking.
+
+        Returns: record, None if none came within [timeout] seconds
+         or the writer has ended
+        """
+        header = self.__header
+        deadline = time.monotonic() + timeout
+        while True:
+            written = int(header[WRITTEN])
+            if written > self.read:
+                if written - self.read > self.slots:
+                    self.lost += written - self.slots - self.read
+                    self.read = written - self.slots
+
+                slot = self.read % self.slots
+                record = self.__records[slot].copy()
+                self.read += 1
+                if (record['seq'] == self.read
+                        and self.__records['seq'][slot] == self.read):
+                    header[READ] = self.read - 1
+                    return record
+                self.lost += 1
+            elif header[ENDED] or time.monotonic() > deadline:
+                return None
+            else:
+                time.sleep(self.POLL)
+
+    def frame(self, record):
+        """Return ROI crop of [record], a view into the ring.
+
+        Without blocking it may be overwritten while in use, copy it
+         first if it must stay whole.
+        """
+        slot = (record['seq'] - 1) % self.slots
+        return self.__frames[slot, :record['height'], :record['width']]
+
+    def masks(self, record):
+        """Return masks of [record] as put, views into the ring (list).
+
+        As with frame(), copy a mask first if it must stay whole.
+        """
+        slot = (record['seq'] - 1) % self.slots
+        masks = []
+        for index, (height, width) in enumerate(record['mask_size']):
+            if not height:
+                masks.append(None)
+                continue
+            masks.append((self.__masks[slot, index, :height, :width],
+                          tuple(record['mask_shape'][index].tolist())))
+        return masks
+
+    def end(self):
+        """Tell the reader no more frames are coming."""
+        self.__header[ENDED] = 1
+
+    def ended(self):
+        """Return True once the writer ended and every frame was read."""
+        return bool(self.__header[ENDED]) and (
+            self.__header[WRITTEN] <= self.read)
+
+    def stop(self):
+        """Ask the writer to stop putting frames."""
+        self.__header[STOPPED] = 1
+
+    def close(self, unlink=False):
+        """Detach from the shared memory. [unlink] it if made here."""
+        del self.__header, self.__records, self.__frames, self.__masks
+        self.__memory.close()
+        if unlink:
+            self.__memory.unlink()
+
+
+def attach(name):
+    """Return shared memory [name], made and unlinked by another process.
+
+    Left untracked, else this process's resource tracker unlinks it
+     as soon as this process exits, while the other may still use it.
+    """
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        memory = shared_memory.SharedMemory(name)
+        resource_tracker.unregister(memory._name, 'shared_memory')
+        return memory
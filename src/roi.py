@@ -12,23 +12,65 @@ class ROI():
          set bounds to default of 400^2.
         Bounds will update when camera capture is first instantiated.
 
-        Uses bounds in **kwargs if given.
+        If coordinates=[west, north, east, south] are given they are used
+         instead of the full frame once bounds are known.
+
+        regions={name: [west, north, east, south]} adds further regions.
+         The ROI itself is always the region named 'main'.
+
+        Uses bounds, coordinates and regions in **kwargs if given.
         Passes kywd=arg pairs down MRO chain.
         """
-        super().__init__(**kwargs)
-
         if 'bounds' in kwargs:
             self.__bounds = kwargs.pop('bounds')
         else:
             self.__bounds = (400, 400)
-        self._coordinates = [0, 0, self.__bounds[1], self.__bounds[0]]
+        self.__start = (kwargs.pop('coordinates') if 'coordinates' in kwargs
+                        else None)
+        self.__starts = kwargs.pop('regions') if 'regions' in kwargs else {}
+        if 'main' in self.__starts:
+            raise Exception("Region name 'main' is taken by the ROI itself.")
+        super().__init__(**kwargs)
+
+        self.regions = {}
+        self.__editing = 'main'
+        self.set_bounds(self.__bounds)
 
         print(":: ROI INITIALIZED ::\n")
 
     def set_bounds(self, bounds):
-        """Update the maximum bounds for the ROI."""
+        """Update the maximum bounds for the ROI.
+
+        Resets ROI to the starting coordinates, or the full frame.
+        Other regions are reset to their starting coordinates.
+        """
         self.__bounds = bounds
         self._coordinates = [0, 0, self.__bounds[1], self.__bounds[0]]
+        if self.__start:
+            self._coordinates[:] = self.__start
+            self.__check_bounds(self._coordinates)
+
+        self.regions = {'main': self._coordinates}
+        for name, start in self.__starts.items():
+            self.regions[name] = list(start)
+            self.__check_bounds(self.regions[name])
+
+    def set_region(self, coordinates, name='main'):
+        """Move region [name] to coordinates, within bounds."""
+        self.regions[name][:] = coordinates
+        self.__check_bounds(self.regions[name])
+
+    def union(self):
+        """Return smallest rectangle holding every region.
+
+        Returns: [west, north, east, south] (list)
+        """
+        regions = list(self.regions.values())
+        return [min(region[0] for region in regions),
+                min(region[1] for region in regions),
+                max(region[2] for region in regions),
+                max(region[3] for region in regions),
+                ]
 
     def set_roi(self, key):
         """Set ROI for drop event capture using key input.
@@ -37,7 +79,15 @@ class ROI():
         A/D control the leftmost border of the ROI.
         I/K control the bottom border of the ROI.
         J/L control the rightmost border of the ROI.
+        Tab switches which region the keys move.
         """
+        if key == ord('\t') and len(self.regions) > 1:
+            names = list(self.regions)
+            self.__editing = names[(names.index(self.__editing) + 1)
+                                   % len(names)]
+            print("Editing region: {}".format(self.__editing))
+            return
+
         key = key & 0xDF
         keys = {ord('W'): (1, -5), ord('S'): (1, 5),
                 ord('A'): (0, -5), ord('D'): (0, 5),
@@ -46,17 +96,22 @@ class ROI():
                 }
 
         if key in keys:
-            self._coordinates[keys[key][0]] += keys[key][1]
-            self.__check_bounds()
+            coordinates = self.regions[self.__editing]
+            coordinates[keys[key][0]] += keys[key][1]
+            self.__check_bounds(coordinates)
 
             print("Coordinates: ({0}, {1}), ({2}, {3})"
-                  .format(*self._coordinates)
+                  .format(*coordinates)
                   )
 
-    def __check_bounds(self):
-        """Restric ROI to camera capture dimensions."""
-        for coord in range(3):
-            if self._coordinates[coord] < 0:
-                self._coordinates[coord] = 0
-            elif self._coordinates[coord] > self.__bounds[coord // 2]:
-                self._coordinates[coord] = self.__bounds[coord // 2]
+    def __check_bounds(self, coordinates):
+        """Restric region to camera capture dimensions.
+
+        West/east are bound by the width, north/south by the height.
+        """
+        for coord in range(4):
+            limit = self.__bounds[1 - coord % 2]
+            if coordinates[coord] < 0:
+                coordinates[coord] = 0
+            elif coordinates[coord] > limit:
+                coordinates[coord] = limit
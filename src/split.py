@@ -0,0 +1,299 @@
+"""Run vision and control in separate processes.
+
+Capture and detection run in a vision process, control in the process
+ the experiment was made in. They share frames through a FrameRing in
+ shared memory, see ring.py, so each side has a core of its own and
+ only has to keep up with the camera by itself.
+"""
+import multiprocessing
+import signal
+import time
+
+from .clock import Clock
+from .control import Control
+from .monitor import EndOfStream, Monitor
+from .profiler import Profiler
+from .ring import FrameRing
+from .terminal import KeyReader
+
+VISION_OPTIONS = ('src', 'threaded', 'queue_size', 'headless',
+                  'display_every', 'scale', 'channel', 'replay', 'detector',
+                  'bounds', 'coordinates')
+
+
+class Vision(Monitor):
+    """Vision Side of a SplitExperiment.
+
+    A Monitor on its own, with the clock and profiler
+     a Model would otherwise give it.
+    """
+
+    def __init__(self, **kwargs):
+        """Initialize Monitor.
+
+        Uses clock and profile in **kwargs if given.
+        Passes kywd=arg pairs down MRO chain.
+        """
+        self.clock = kwargs.pop('clock') if 'clock' in kwargs else Clock()
+        profile = kwargs.pop('profile') if 'profile' in kwargs else False
+        self.profiler = Profiler() if profile else None
+        super().__init__(**kwargs)
+
+
+def run_vision(options, names, connection, slots, block):
+    """Capture and detect until stopped. Target of the vision process.
+
+    The Vision's bounds are sent over [connection], the name of the ring
+     to fill is sent back. Every frame is detected on, its moving pixels
+     and masks of regions [names], key press and ROI are put in the ring.
+    Keys sent over [connection] meanwhile move the regions.
+    Ctrl-C is left to the control process.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        vision = Vision(**options)
+    except Exception as exc:
+        connection.send(exc)
+        return
+    connection.send(vision.bounds)
+    ring = FrameRing(vision.bounds, len(names), slots, block,
+                     connection.recv())
+
+    try:
+        while True:
+            while connection.poll():
+                vision.set_roi(connection.recv())
+            try:
+                vision.get_frame()
+            except EndOfStream as exc:
+                print(exc)
+                break
+            vision.image_processing()
+            key = vision.show_frame()
+            if not ring.put(vision.capture_no,
+                            vision.frame_time,
+                            vision.frame_stamp,
+                            [vision.region_noise[name] for name in names],
+                            key,
+                            vision.frames_skipped,
+                            vision.roi_frame(),
+                            [vision.masks.get(name) for name in names],
+                            ):
+                break
+    finally:
+        ring.end()
+        vision.shutoff_vision()
+        if vision.profiler:
+            print("Vision process:")
+            print(vision.profiler.report())
+        ring.close()
+
+
+class SplitExperiment(Control, ):
+    """Experiment Split over Two Processes.
+
+    Vision runs in a process of its own, see run_vision.
+    The control algorithm runs here. It takes each frame's noise from
+     the ring and controls the main and every region's Dripper on it
+     through Control, as Experiment does.
+
+    Keys pressed in the window, or in the terminal when headless,
+     are handled here and passed on to vision to move the regions.
+
+    Only the core loop is split. Calibration files, checkpoints, clips,
+     auto ROI and notes need the single process Experiment.
+    """
+
+    JOIN_TIMEOUT = 10
+
+    def __init__(self, title='', user='Default', viscosity=50, **kwargs):
+        """Initialize control side, then start the vision process.
+
+        Monitor options, as listed in VISION_OPTIONS, are passed on to
+         Vision along with the clock, profile and region coordinates.
+        regions is used as in Experiment, autostart, telemetry,
+         telemetry_host and started by Control. interactive is ignored,
+         no notes are asked for.
+
+        The ring holds [ring_slots] frames. When replaying, vision waits
+         for a full ring to be read, so the drop log is the same as
+         a single process replay. Live, frames not read before vision
+         comes round again are lost, counted in frames_lost.
+
+        Arguments are passed by keyword or by order.
+        Further kywd=arg pairs passed down MRO chain.
+        """
+        kwargs.pop('interactive', None)
+        regions = kwargs.pop('regions') if 'regions' in kwargs else []
+        slots = kwargs.pop('ring_slots') if 'ring_slots' in kwargs else 16
+        options = {key: kwargs.pop(key) for key in VISION_OPTIONS
+                   if key in kwargs}
+        for key in ('clock', 'profile'):
+            if key in kwargs:
+                options[key] = kwargs[key]
+        options['regions'] = {region['name']: region['coordinates']
+                              for region in regions}
+        super().__init__(title=title, user=user, viscosity=viscosity,
+                         **kwargs)
+
+        self.replay = options.get('replay', False)
+        self.__quit = False
+
+        self.capture_no = 0
+        self.frame_stamp = time.monotonic()
+        self.frames_skipped = 0
+
+        for region in regions:
+            self.add_dripper(**region)
+        self.__names = ['main'] + list(self.drippers)
+
+        self.__keys = KeyReader() if options.get('headless') else None
+        self.__connection, connection = multiprocessing.Pipe()
+        self.__vision = multiprocessing.Process(
+            target=run_vision,
+            args=(options, self.__names, connection, slots, self.replay),
+            name=title + "_vision",
+            daemon=True,
+            )
+        self.__vision.start()
+
+        bounds = self.__connection.recv()
+        if isinstance(bounds, Exception):
+            self.__vision.join()
+            raise bounds
+        self.ring = FrameRing(bounds, len(self.__names), slots,
+                              self.replay)
+        self.__connection.send(self.ring.name)
+
+        print(":: SPLIT EXPERIMENT INITIALIZED ::\n")
+
+    @property
+    def frames_lost(self):
+        """Frames vision overwrote before control read them."""
+        return self.ring.lost
+
+    def main(self):
+        """Control algorithm implementation.
+
+        Runs step() until every drip point is saturated,
+         vision stops or interrupted, then terminates.
+        """
+        try:
+            try:
+                while not self.all_saturated() and self.step():
+                    pass
+            except KeyboardInterrupt:
+                print("Program interrupted by keyboard!")
+        finally:
+            self.terminate()
+
+    def step(self):
+        """Control every drip point on the noise of the next frame.
+
+        If profiling, each step is timed as a 'frame' stage,
+         waiting on vision included.
+
+        Returns: False once vision stopped or quit by key, else True
+        """
+        if self.profiler:
+            mark = self.profiler.start()
+        record = self.ring.get()
+        if record is None:
+            if self.ring.ended() or not self.__vision.is_alive():
+                print("Vision stopped after {} frames."
+                      .format(self.capture_no))
+                return False
+            return True
+
+        self.capture_no = int(record['capture'])
+        self.frame_time = float(record['time'])
+        self.frame_stamp = float(record['stamp'])
+        self.frames_skipped = int(record['skipped'])
+        if self.replay:
+            self.clock.set(self.frame_time)
+        if self.telemetry and self.telemetry.wants_preview():
+            self.telemetry.preview(self.ring.frame(record))
+
+        if self.defaults_set:
+            self.frame_no += 1
+            noise = dict(zip(self.__names, record['noise'].tolist()))
+            masks = dict(zip(self.__names, self.ring.masks(record)))
+            self.control_all(noise, masks)
+
+        key = int(record['key'])
+        if self.__keys and key == KeyReader.NO_KEY:
+            key = self.__keys.read()
+        self.key_input(key)
+        self.report_status()
+        if self.profiler:
+            self.profiler.stop('frame', mark)
+        return not self.__quit
+
+    def key_input(self, key):
+        """Apply key to the valve and run state. Pass it on to vision."""
+        self.set_volts(key)
+        if key == KeyReader.NO_KEY:
+            return
+        self.__connection.send(key)
+
+        if key == ord('0'):
+            if not self.defaults_set:
+                print("Calibrating...")
+            self.defaults_set = True
+            return
+
+        key = key & 0xDF
+        if key == ord('R'):
+            self.defaults_set = False
+        elif key == ord('Q'):
+            print("Program terminated by keyboard input!")
+            self.__quit = True
+
+    def status(self):
+        """Return snapshot of the experiment's state (dict).
+
+        Frames lost between the processes are under 'frames_lost'.
+        """
+        status = super().status()
+        status['frames_lost'] = self.frames_lost
+        return status
+
+    def summary_text(self):
+        """Return essential experiment statistics (str)."""
+        return (super().summary_text()
+                + "Frames lost between processes: {}\n        ".format(
+                    self.frames_lost))
+
+    def terminate(self):
+        """Execute termination procedure.
+
+        1. Start fully closing every valve.
+        2. Stop the vision process.
+        3. Print summary.
+        4. Write footer and profile if any to the log, close the logs.
+        5. Wait for the valves to finish closing, free the ring.
+        """
+        print("Terminating...\n")
+        self.actuator.shutoff()
+        for dripper in self.drippers.values():
+            dripper.actuator.shutoff()
+        self.ring.stop()
+        self.__vision.join(self.JOIN_TIMEOUT)
+        if self.__vision.is_alive():
+            self.__vision.terminate()
+        if self.__keys:
+            self.__keys.restore()
+        self.summary()
+        if self.telemetry:
+            self.listeners.remove(self.telemetry.publish)
+            self.telemetry.stop()
+
+        final_data = self.footer()
+        if self.profiler:
+            final_data += self.profiler.report("\n        ")
+        self.log.close(final_data)
+        self.actuator.stop()
+        for dripper in self.drippers.values():
+            dripper.finish()
+        self.ring.close(unlink=True)
+        self.terminated = True
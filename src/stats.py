@@ -0,0 +1,82 @@
+import math
+
+
+class NoiseStats():
+    """Streaming Noise Statistics.
+
+    Tracks mean, variance, median and median absolute deviation (MAD)
+     of a stream of values, in constant time and memory per value.
+    Each estimate mostly follows the last [window] values,
+     so they drift along with e.g. lighting.
+
+    Mean and variance are exponentially weighted moving averages (EWMA).
+    Median and MAD are tracked by nudging them towards each new value,
+     in steps scaled by the MAD. Spikes such as drops or ripples
+     move them no more than any other value would.
+    They start from the exact median and MAD of the first SEED values.
+    """
+
+    SEED = 15
+
+    def __init__(self, window=250):
+        """Start empty statistics following the last [window] values."""
+        self.window = window
+        self.alpha = 2 / (window + 1)
+        self.count = 0
+        self.mean = 0.0
+        self.variance = 0.0
+        self.median = 0.0
+        self.mad = 0.0
+        self.__seed = []
+
+    def add(self, value):
+        """Update every statistic with [value].
+
+        Until [window] values are seen the weights of a plain average
+         are used instead, so the first values do not dominate.
+        """
+        self.count += 1
+        alpha = max(self.alpha, 1 / self.count)
+        difference = value - self.mean
+        increment = alpha * difference
+        self.mean += increment
+        self.variance = (1 - alpha) * (self.variance + difference * increment)
+
+        if self.__seed is not None:
+            self.__seed.append(value)
+            self.median = middle(self.__seed)
+            self.mad = middle([abs(seed - self.median)
+                               for seed in self.__seed])
+            if len(self.__seed) == self.SEED:
+                self.__seed = None
+            return
+
+        step = alpha * max(self.mad, 1)
+        deviation = value - self.median
+        self.median += math.copysign(step, deviation) if deviation else 0
+        deviation = abs(deviation) - self.mad
+        self.mad += math.copysign(step, deviation) if deviation else 0
+
+    def state(self):
+        """Return statistics as a list, for restore()."""
+        return [self.count, self.mean, self.variance, self.median, self.mad]
+
+    def restore(self, state):
+        """Carry on from statistics returned by state()."""
+        count, self.mean, self.variance, self.median, self.mad = state
+        self.count = int(count)
+        if self.count:
+            self.__seed = None
+
+    def std(self):
+        """Return moving standard deviation."""
+        return math.sqrt(self.variance)
+
+
+def middle(values):
+    """Return exact median of a short list of values."""
+    values = sorted(values)
+    half = len(values) // 2
+    if len(values) % 2:
+        return float(values[half])
+    return (values[half - 1] + values[half]) / 2
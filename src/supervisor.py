@@ -0,0 +1,222 @@
+"""Run several saturation rigs from one host.
+
+Each rig is an Experiment in its own process, pinned round robin to the
+ host's CPU cores so their vision work runs in parallel. Rigs report
+ their status to the supervisor, which shows every rig in one table,
+ and restarts a rig that crashed without touching the others.
+
+Config is a JSON file:
+    {"restart_delay": 5,
+     "max_restarts": 10,
+     "rigs": [{"name": "A", "src": 0, "address": 98,
+               "viscosity": 30, "spd": 2, "volts": 1200},
+              {"name": "B", "src": 1, "address": 99, "viscosity": 50}]}
+Every rig key other than name is passed to Experiment, title defaults
+ to the name. Rigs run headless with the external DAC unless told
+ otherwise, e.g. "dac": "sim".
+A rig with a "checkpoint" path is resumed from it when restarted,
+ else it starts new logs beside those of the run that crashed.
+
+Usage:
+    python -m src.supervisor CONFIG
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import time
+
+RIG_DEFAULTS = {'headless': True,
+                'interactive': False,
+                'autostart': True,
+                'dac': 'hw',
+                }
+
+
+def run_rig(name, options, updates, cpu=None):
+    """Run one rig's Experiment until it ends. Target of a rig process.
+
+    Status and drop events are put on [updates] as (name, event, data).
+    Ctrl-C is left to the supervisor, SIGTERM stops the rig cleanly.
+    Exits with 0 if the experiment terminated properly, else 1.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, interrupt)
+    if cpu is not None and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {cpu})
+
+    from .experiment import Experiment
+
+    options = dict(RIG_DEFAULTS, **options)
+    experiment = Experiment(options.pop('title', name), **options)
+    experiment.listeners.append(
+        lambda event, data: updates.put((name, event, data)))
+    experiment.main()
+
+    sys.exit(0 if experiment.terminated else 1)
+
+
+def interrupt(signum, frame):
+    """Turn a termination signal into a KeyboardInterrupt."""
+    raise KeyboardInterrupt
+
+
+class Rig():
+    """Supervised Rig.
+
+    Keeps the options a rig is started with, its current process,
+     latest status and how often it has been restarted.
+    """
+
+    def __init__(self, name, options, cpu):
+        """Prepare rig [name], started on [cpu] with Experiment [options]."""
+        self.name = name
+        self.options = options
+        self.cpu = cpu
+        self.process = None
+        self.status = {'state': 'starting'}
+        self.restarts = 0
+        self.died = None
+        self.finished = False
+
+    def start(self, updates):
+        """Start rig process."""
+        self.process = multiprocessing.Process(
+            target=run_rig,
+            args=(self.name, self.options, updates, self.cpu),
+            name=self.name,
+            )
+        self.process.start()
+        self.died = None
+
+
+class Supervisor():
+    """Multi-rig Supervisor.
+
+    Starts every rig, collects their updates into a shared status table
+     and restarts crashed rigs after [restart_delay] seconds,
+     at most [max_restarts] times each.
+    """
+
+    def __init__(self, rigs, restart_delay=5, max_restarts=10, interval=2):
+        """Prepare rigs from a list of option dicts, each with a name."""
+        cpus = os.cpu_count() or 1
+        self.rigs = []
+        for index, options in enumerate(rigs):
+            options = dict(options)
+            name = str(options.pop('name', index))
+            self.rigs.append(Rig(name, options, index % cpus))
+
+        self.restart_delay = restart_delay
+        self.max_restarts = max_restarts
+        self.interval = interval
+        self.updates = multiprocessing.Queue()
+
+    def run(self):
+        """Supervise until every rig has finished or gave up restarting."""
+        for rig in self.rigs:
+            rig.start(self.updates)
+
+        shown = 0
+        try:
+            while not all(rig.finished for rig in self.rigs):
+                self.receive(self.interval / 4)
+                self.check()
+                if time.monotonic() - shown > self.interval:
+                    shown = time.monotonic()
+                    self.show()
+        except KeyboardInterrupt:
+            print("Supervisor interrupted, stopping rigs...")
+            self.stop()
+        self.show()
+
+    def receive(self, timeout):
+        """Apply rig updates that arrive within [timeout] seconds."""
+        rigs = {rig.name: rig for rig in self.rigs}
+        try:
+            name, event, data = self.updates.get(timeout=timeout)
+            while True:
+                if event == 'status':
+                    rigs[name].status = data
+                elif event == 'drop' and 'region' not in data:
+                    rigs[name].status['drops'] = (
+                        rigs[name].status.get('drops', 0) + 1)
+                name, event, data = self.updates.get_nowait()
+        except queue.Empty:
+            pass
+
+    def check(self):
+        """Note finished rigs, restart crashed ones once their delay is up."""
+        for rig in self.rigs:
+            if rig.finished or rig.process.is_alive():
+                continue
+
+            if rig.process.exitcode == 0:
+                rig.finished = True
+                rig.status['state'] = 'finished'
+            elif rig.restarts >= self.max_restarts:
+                rig.finished = True
+                rig.status['state'] = 'failed'
+            elif rig.died is None:
+                rig.died = time.monotonic()
+                rig.status['state'] = 'crashed'
+                print("Rig {} crashed (exit code {}), restarting in {}s."
+                      .format(rig.name, rig.process.exitcode,
+                              self.restart_delay))
+            elif time.monotonic() - rig.died > self.restart_delay:
+                rig.restarts += 1
+                rig.status = {'state': 'restarting'}
+                if 'checkpoint' in rig.options:
+                    rig.options['resume'] = os.path.exists(
+                        rig.options['checkpoint'])
+                rig.start(self.updates)
+
+    def show(self):
+        """Print one status line per rig."""
+        print("Rig\tState\t\tTime\tFrame\tDrops\tVolts\tNoise\tRestarts")
+        for rig in self.rigs:
+            status = rig.status
+            print("{}\t{:<12}\t{:.0f}\t{}\t{}\t{:.0f}\t{:.2f}\t{}".format(
+                  rig.name,
+                  status.get('state', ''),
+                  status.get('time', 0),
+                  status.get('frame', 0),
+                  status.get('drops', 0),
+                  status.get('volts', 0),
+                  status.get('noise_average', 0),
+                  rig.restarts,
+                  ))
+        print()
+
+    def stop(self, timeout=30):
+        """Signal every rig to terminate cleanly, kill any that hang."""
+        for rig in self.rigs:
+            rig.finished = True
+            if rig.process.is_alive():
+                rig.process.terminate()
+        for rig in self.rigs:
+            rig.process.join(timeout)
+            if rig.process.is_alive():
+                rig.process.kill()
+            rig.status['state'] = 'stopped'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('config')
+    args = parser.parse_args()
+
+    with open(args.config) as config_file:
+        config = json.load(config_file)
+
+    Supervisor(config['rigs'],
+               config.get('restart_delay', 5),
+               config.get('max_restarts', 10),
+               ).run()
+
+
+if __name__ == '__main__':
+    main()
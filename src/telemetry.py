@@ -0,0 +1,293 @@
+"""Local telemetry server.
+
+Serves an experiment's events and ROI previews over HTTP and websocket,
+ from an asyncio loop on its own thread, using only the standard library.
+
+    GET /              page showing the latest status and preview
+    GET /status        latest status event (JSON)
+    GET /preview.jpg   latest preview (JPEG)
+    GET /events        websocket: every event as JSON text,
+                        previews as binary JPEG messages
+
+The control loop only hands events and, now and then, a copy of the ROI
+ to the server. Previews are downscaled and encoded on a worker thread,
+ skipped while one is still being encoded. Each client has a short
+ queue, the oldest messages are dropped when a client falls behind.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import threading
+import time
+
+import cv2
+
+GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+PAGE = b"""<!DOCTYPE html>
+<html><head><title>Saturation System</title></head>
+<body style="font-family: monospace">
+<img id="preview"><pre id="status">Connecting...</pre><pre id="events"></pre>
+<script>
+var socket = new WebSocket("ws://" + location.host + "/events");
+var events = [];
+socket.binaryType = "blob";
+socket.onmessage = function (message) {
+  if (typeof message.data !== "string") {
+    var preview = document.getElementById("preview");
+    URL.revokeObjectURL(preview.src);
+    preview.src = URL.createObjectURL(message.data);
+    return;
+  }
+  var event = JSON.parse(message.data);
+  if (event.event === "status") {
+    document.getElementById("status").textContent =
+      JSON.stringify(event, null, 1);
+  } else {
+    events.unshift(message.data);
+    events = events.slice(0, 20);
+    document.getElementById("events").textContent = events.join("\\n");
+  }
+};
+</script></body></html>
+"""
+
+
+class TelemetryServer():
+    """Asyncio HTTP/Websocket Telemetry Server.
+
+    publish() is an Experiment listener, preview() takes ROI frames.
+    Both return at once, all network work is done on the server thread.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8080, interval=0.5, scale=2,
+                 quality=70, backlog=16):
+        """Start serving on [host]:[port].
+
+        interval: least seconds between previews.
+        scale: previews are shrunk [scale] times in each direction.
+        quality: JPEG quality of previews, 0 to 100.
+        backlog: messages held for a client before dropping the oldest.
+        """
+        self.host = host
+        self.interval = interval
+        self.scale = scale
+        self.quality = quality
+        self.backlog = backlog
+        self.clients = 0
+        self.dropped = 0
+
+        self.__status = ""
+        self.__jpeg = b""
+        self.__queues = set()
+        self.__encoding = False
+        self.__previewed = 0
+
+        self.__loop = asyncio.new_event_loop()
+        self.__started = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, args=(port,),
+                                         daemon=True)
+        self.__thread.start()
+        self.__started.wait()
+        if self.__error:
+            raise self.__error
+
+    def publish(self, event, data):
+        """Send event to every client. Listener signature."""
+        message = json.dumps(dict(data, event=event), default=plain)
+        self.__loop.call_soon_threadsafe(self.__broadcast, event, message)
+
+    def wants_preview(self):
+        """Return True if a preview would be sent now."""
+        return (self.clients > 0 and not self.__encoding
+                and time.monotonic() - self.__previewed >= self.interval)
+
+    def preview(self, frame):
+        """Encode a copy of BGR [frame] as the next preview.
+
+        Skipped unless wants_preview(), so it is cheap to call.
+        """
+        if not self.wants_preview():
+            return
+        self.__encoding = True
+        self.__previewed = time.monotonic()
+        self.__loop.call_soon_threadsafe(self.__encode, frame.copy())
+
+    def stop(self):
+        """Disconnect clients and stop the server thread."""
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__thread.join()
+
+    def __run(self, port):
+        """Serve until stopped. Target of the server thread."""
+        asyncio.set_event_loop(self.__loop)
+        self.__error = None
+        try:
+            self.__server = self.__loop.run_until_complete(
+                asyncio.start_server(self.__handle, self.host, port))
+            self.port = self.__server.sockets[0].getsockname()[1]
+        except OSError as exc:
+            self.__error = exc
+            self.__started.set()
+            return
+        self.__started.set()
+
+        self.__loop.run_forever()
+        self.__server.close()
+        for task in asyncio.all_tasks(self.__loop):
+            task.cancel()
+        self.__loop.run_until_complete(asyncio.sleep(0))
+        self.__loop.close()
+
+    def __broadcast(self, event, message):
+        """Queue message for every client, dropping their oldest if full."""
+        if event == 'status':
+            self.__status = message
+        for messages in self.__queues:
+            if messages.full():
+                messages.get_nowait()
+                self.dropped += 1
+            messages.put_nowait(message)
+
+    def __encode(self, frame):
+        """Start encoding [frame] on the loop's worker threads."""
+        future = self.__loop.run_in_executor(None, self.__jpeg_of, frame)
+        future.add_done_callback(self.__encoded)
+
+    def __jpeg_of(self, frame):
+        """Return downscaled [frame] as JPEG bytes."""
+        if self.scale > 1:
+            height, width = frame.shape[:2]
+            size = (max(1, width // self.scale), max(1, height // self.scale))
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        __, jpeg = cv2.imencode('.jpg', frame,
+                                [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        return jpeg.tobytes()
+
+    def __encoded(self, future):
+        """Send finished preview to every client."""
+        self.__encoding = False
+        if future.cancelled() or future.exception():
+            return
+        self.__jpeg = future.result()
+        self.__broadcast('preview', self.__jpeg)
+
+    async def __handle(self, reader, writer):
+        """Answer one HTTP request, or serve a websocket."""
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+            lines = request.decode('latin-1').split("\r\n")
+            path = lines[0].split(" ")[1] if " " in lines[0] else "/"
+            headers = {}
+            for line in lines[1:]:
+                key, colon, value = line.partition(":")
+                if colon:
+                    headers[key.strip().lower()] = value.strip()
+
+            if path == '/events' and 'sec-websocket-key' in headers:
+                await self.__websocket(reader, writer,
+                                       headers['sec-websocket-key'])
+            elif path == '/':
+                await respond(writer, 200, 'text/html', PAGE)
+            elif path == '/status':
+                await respond(writer, 200, 'application/json',
+                              (self.__status or "{}").encode())
+            elif path == '/preview.jpg' and self.__jpeg:
+                await respond(writer, 200, 'image/jpeg', self.__jpeg)
+            else:
+                await respond(writer, 404, 'text/plain', b"Not found")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def __websocket(self, reader, writer, key):
+        """Push queued messages to a websocket client until it leaves."""
+        accept = base64.b64encode(hashlib.sha1(
+            (key + GUID).encode()).digest()).decode()
+        writer.write("HTTP/1.1 101 Switching Protocols\r\n"
+                     "Upgrade: websocket\r\n"
+                     "Connection: Upgrade\r\n"
+                     "Sec-WebSocket-Accept: {}\r\n\r\n"
+                     .format(accept).encode())
+
+        messages = asyncio.Queue(self.backlog)
+        if self.__status:
+            messages.put_nowait(self.__status)
+        self.__queues.add(messages)
+        self.clients += 1
+        listening = asyncio.ensure_future(discard(reader))
+        try:
+            while not listening.done():
+                getting = asyncio.ensure_future(messages.get())
+                await asyncio.wait((getting, listening),
+                                   return_when=asyncio.FIRST_COMPLETED)
+                if not getting.done():
+                    getting.cancel()
+                    break
+                writer.write(frame(getting.result()))
+                await writer.drain()
+        finally:
+            listening.cancel()
+            self.__queues.discard(messages)
+            self.clients -= 1
+
+
+async def respond(writer, status, content_type, body):
+    """Write a whole HTTP response."""
+    reason = {200: "OK", 404: "Not Found"}[status]
+    writer.write("HTTP/1.1 {} {}\r\n"
+                 "Content-Type: {}\r\n"
+                 "Content-Length: {}\r\n"
+                 "Cache-Control: no-store\r\n"
+                 "Connection: close\r\n\r\n"
+                 .format(status, reason, content_type, len(body)).encode())
+    writer.write(body)
+    await writer.drain()
+
+
+def frame(message):
+    """Return websocket frame of str (text) or bytes (binary) [message]."""
+    if isinstance(message, str):
+        opcode, payload = 0x81, message.encode()
+    else:
+        opcode, payload = 0x82, message
+
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack("!BBH", opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", opcode, 127, length)
+    return header + payload
+
+
+def plain(value):
+    """Return numpy [value] as plain Python values, for json.dumps.
+
+    Numpy integers stay integers, arrays become lists.
+    """
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError("{} is not JSON serializable"
+                    .format(type(value).__name__))
+
+
+async def discard(reader):
+    """Read and ignore client frames until it closes the websocket."""
+    try:
+        while True:
+            opcode, length = await reader.readexactly(2)
+            length &= 0x7F
+            if length == 126:
+                length = struct.unpack("!H", await reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack("!Q", await reader.readexactly(8))[0]
+            await reader.readexactly(4 + length)
+            if opcode & 0x0F == 0x8:
+                return
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return
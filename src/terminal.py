@@ -0,0 +1,66 @@
+import os
+import select
+import sys
+
+try:
+    import termios
+    termios_lib = True
+except Exception as exc:
+    print("Exception: {}\n".format(exc))
+    termios_lib = False
+
+
+class KeyReader():
+    """Non-blocking Terminal Key Reader.
+
+    Replacement for cv2.waitKey when running without a window.
+    Puts the terminal in non-canonical mode so single key presses
+     are available without waiting for Enter.
+    Echo is left on so prompts such as notes stay readable.
+
+    If stdin is not a terminal, or termios is unavailable,
+     no keys are ever reported.
+    """
+
+    NO_KEY = 0xFF
+
+    def __init__(self, stream=None):
+        """Switch terminal to non-canonical mode. Save settings to restore."""
+        self.__stream = stream if stream else sys.stdin
+        self.__fd = None
+        self.__settings = None
+
+        try:
+            fd = self.__stream.fileno()
+        except (AttributeError, ValueError, OSError):
+            return
+
+        if termios_lib and os.isatty(fd):
+            self.__fd = fd
+            self.__settings = termios.tcgetattr(fd)
+            mode = termios.tcgetattr(fd)
+            mode[3] &= ~termios.ICANON
+            mode[6][termios.VMIN] = 1
+            mode[6][termios.VTIME] = 0
+            termios.tcsetattr(fd, termios.TCSANOW, mode)
+
+    def read(self):
+        """Poll for a key press without blocking.
+
+        Returns: ASCII value of key pressed, 0xFF if none (int)
+        """
+        if self.__fd is None:
+            return self.NO_KEY
+
+        ready, _, _ = select.select([self.__fd], [], [], 0)
+        if ready:
+            char = os.read(self.__fd, 1)
+            if char:
+                return char[0]
+        return self.NO_KEY
+
+    def restore(self):
+        """Return terminal to the settings it had before."""
+        if self.__settings is not None:
+            termios.tcsetattr(self.__fd, termios.TCSADRAIN, self.__settings)
+            self.__settings = None
@@ -0,0 +1,263 @@
+"""Monte Carlo tuning of the valve controller.
+
+Fits a drip plant to drop logs, then simulates thousands of controller
+ parameter sets at once, each over several noisy trials, as numpy arrays
+ stepped together in time. Sets settling in every trial are ranked by
+ settling time of their drop rate, then by overshoot, so candidates can
+ be chosen before any hardware trial.
+
+Plant: drops per second = gain * (volts - 45) * jitter, 45 being the
+ calibrated off voltage. Jitter is lognormal, redrawn for every drop.
+ A share of drops is followed by a ripple spike a moment later.
+Controller: as Dripper and Valve, volts = optimal + (interval - spd) * k
+ on each detected drop, spikes within ripple_delay of a drop ignored,
+ and after clog_delay without drops volts ramp up by [ramp] every 10s.
+
+Usage:
+    python -m src.tuning LOG [LOG ...] [--volts V] [--spd S] [--sets N]
+                         [--trials N] [--duration S] [--top N]
+"""
+import argparse
+
+import numpy as np
+
+from .analysis import read_log
+
+OFF_VOLTS = 45
+MAX_VOLTS = 4055
+CLOG_INTERVAL = 10
+RIPPLE_WINDOW = 0.5
+TOLERANCE = 0.2
+SMOOTHING = 8
+
+PARAMETERS = ('gain', 'ripple_delay', 'clog_delay', 'ramp')
+DEFAULTS = {'gain': 50, 'ripple_delay': 0.1, 'clog_delay': 30, 'ramp': 80}
+RANGES = {'gain': (1, 300),
+          'ripple_delay': (0.05, 0.5),
+          'clog_delay': (10, 60),
+          'ramp': (20, 240),
+          }
+
+
+def fit_plant(paths):
+    """Fit plant to the drops of the logs at [paths].
+
+    Intervals shorter than RIPPLE_WINDOW are taken as ripples, the rest
+     as drops at the volts logged with them.
+    Gain is the least squares slope of drop rate over volts above off,
+     through off, so opening the valve can never slow drops down.
+
+    Returns: {'gain', 'jitter', 'ripple_share', 'ripple_lag', 'drops'}
+    """
+    volts, intervals = [], []
+    for path in paths:
+        drops = read_log(path)['drops']
+        volts.append(drops['volts'][1:])
+        intervals.append(drops['time_since_drop'][1:])
+    volts = np.concatenate(volts) - OFF_VOLTS
+    intervals = np.concatenate(intervals)
+
+    ripples = intervals < RIPPLE_WINDOW
+    drops = ~ripples & (intervals > 0) & (volts > 0)
+    if drops.sum() < 2:
+        raise Exception("Not enough drops in logs to fit a plant.")
+
+    rates = 1 / intervals[drops]
+    opening = volts[drops]
+    gain = np.sum(opening * rates) / np.sum(opening * opening)
+
+    return {'gain': gain,
+            'jitter': np.std(np.log(rates / (gain * opening))),
+            'ripple_share': ripples.sum() / max(1, drops.sum()),
+            'ripple_lag': (np.median(intervals[ripples]) if ripples.any()
+                           else RIPPLE_WINDOW / 2),
+            'drops': int(drops.sum()),
+            }
+
+
+def sample(sets, rng):
+    """Draw [sets] parameter sets uniformly from RANGES.
+
+    The first set is always DEFAULTS, to compare against.
+
+    Returns: {parameter: array}
+    """
+    parameters = {name: rng.uniform(*RANGES[name], sets)
+                  for name in PARAMETERS}
+    for name in PARAMETERS:
+        parameters[name][0] = DEFAULTS[name]
+    return parameters
+
+
+def simulate(parameters, plant, volts, spd, trials=8, duration=900,
+             step=0.05, seed=0):
+    """Simulate every parameter set [trials] times over [duration] seconds.
+
+    All runs advance together, one array element each,
+     in time steps of [step] seconds.
+    Settling is judged on the drop rate the plant gives at the applied
+     volts, averaged over jitter, so single late or early drops do not
+     count against a set. Smoothed over about SMOOTHING target drop
+     intervals, it settles when it last left 1/spd +- TOLERANCE.
+     A run still outside at the end did not settle.
+    Overshoot is the largest drop rate past the target rate of 1/spd,
+     after the smoothed rate first came within TOLERANCE.
+
+    Returns: {'settling', 'settled', 'overshoot', 'false_drops',
+     'clogs'}, arrays of the mean over trials for each set,
+     settling over settled trials only, [duration] if none settled,
+     and settled as the share of trials that settled
+    """
+    rng = np.random.default_rng(seed)
+    runs = len(parameters['gain']) * trials
+    gain, ripple_delay, clog_delay, ramp = (
+        np.repeat(parameters[name], trials) for name in PARAMETERS)
+
+    plant_gain = plant['gain']
+    jitter = plant['jitter']
+    share = min(1, plant['ripple_share'])
+    lag = plant['ripple_lag']
+    drift = np.exp(-jitter ** 2 / 2)
+
+    current = np.full(runs, float(volts))
+    clog_volts = current.copy()
+    clogged = np.zeros(runs, dtype=bool)
+    last_clog = np.full(runs, -np.inf)
+    phase = rng.random(runs)
+    scatter = rng.lognormal(0, jitter, runs)
+    ripple_at = np.full(runs, np.inf)
+    last_drop = np.zeros(runs)
+
+    smooth = np.zeros(runs)
+    first_good = np.full(runs, np.inf)
+    last_bad = np.zeros(runs)
+    overshoot = np.zeros(runs)
+    false_drops = np.zeros(runs)
+    clogs = np.zeros(runs)
+
+    for tick in range(1, int(duration / step) + 1):
+        now = tick * step
+        applied = np.where(clogged, clog_volts, current)
+        rate = plant_gain * np.maximum(applied - OFF_VOLTS, 0)
+
+        phase += rate * scatter * step
+        drop = phase >= 1
+        phase -= drop
+        ripple = ripple_at <= now
+        ripple_at[ripple] = np.inf
+
+        if drop.any():
+            count = drop.sum()
+            scatter[drop] = rng.lognormal(0, jitter, count)
+            rippled = drop.copy()
+            rippled[drop] = rng.random(count) < share
+            ripple_at[rippled] = now + lag
+
+        since = now - last_drop
+        detected = (drop | ripple) & (since > ripple_delay)
+        false_drops += detected & ~drop
+
+        smooth += (rate * drift * spd - smooth) * step / (SMOOTHING * spd)
+        good = np.abs(smooth - 1) <= TOLERANCE
+        first_good = np.minimum(first_good, np.where(good, now, np.inf))
+        last_bad = np.where(good, last_bad, now)
+
+        if detected.any():
+            interval = since[detected]
+            current[detected] = np.clip(
+                volts + (interval - spd) * gain[detected],
+                OFF_VOLTS, MAX_VOLTS)
+            clog_volts[detected] = current[detected]
+            clogged[detected] = False
+            last_drop[detected] = now
+
+        stalled = ~(drop | ripple) & (now - last_drop > clog_delay)
+        clogs += stalled & ~clogged
+        clogged |= stalled
+        stepping = clogged & (now - last_clog > CLOG_INTERVAL)
+        clog_volts[stepping] = np.minimum(clog_volts[stepping]
+                                          + ramp[stepping], MAX_VOLTS)
+        last_clog[stepping] = now
+
+        overshoot = np.where(now > first_good,
+                             np.maximum(overshoot, rate * drift * spd - 1),
+                             overshoot)
+
+    settled = good.reshape(-1, trials)
+    settling = np.where(settled, last_bad.reshape(-1, trials), 0).sum(axis=1)
+    count = settled.sum(axis=1)
+
+    def mean(values):
+        return values.reshape(-1, trials).mean(axis=1)
+
+    return {'settling': np.where(count, settling / np.maximum(count, 1),
+                                 duration),
+            'settled': count / trials,
+            'overshoot': mean(overshoot),
+            'false_drops': mean(false_drops),
+            'clogs': mean(clogs),
+            }
+
+
+def rank(results):
+    """Return indices of parameter sets that settled in every trial.
+
+    Shortest settling time first, lowest overshoot breaks ties.
+    Settling times are compared to the second.
+    Empty if no set did, as then settling times tell sets nothing.
+    """
+    order = np.lexsort((results['overshoot'],
+                        np.round(results['settling'])))
+    return order[results['settled'][order] == 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('logs', nargs='+')
+    parser.add_argument('--volts', type=float, default=1000,
+                        help="optimal volts the controller works around")
+    parser.add_argument('--spd', type=float, default=2)
+    parser.add_argument('--sets', type=int, default=2000)
+    parser.add_argument('--trials', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=900)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    plant = fit_plant(args.logs)
+    print("Plant: {gain:.3g} drops/s per volt, jitter {jitter:.2f},"
+          " {ripple_share:.0%} ripples after {ripple_lag:.2f}s,"
+          " from {drops} drops".format(**plant))
+
+    parameters = sample(args.sets, np.random.default_rng(args.seed))
+    results = simulate(parameters, plant, args.volts, args.spd,
+                       args.trials, args.duration, seed=args.seed)
+
+    order = list(rank(results))
+    if not order:
+        print("None settled: no parameter set settled in every trial"
+              " within {:.0f}s.".format(args.duration))
+    print("Rank\tGain\tRipple\tClog\tRamp\tSettle\tOver\tFalse\tClogs")
+    for place, index in enumerate(order[:args.top], 1):
+        print(format_set(place, index, parameters, results))
+    print(format_set(order.index(0) + 1 if 0 in order else '-', 0,
+                     parameters, results), "(current)")
+
+
+def format_set(place, index, parameters, results):
+    """Return one row of the ranking table."""
+    return ("{0}\t{1:.1f}\t{2:.2f}\t{3:.0f}\t{4:.0f}\t{5:.0f}s\t{6:.0%}"
+            "\t{7:.1f}\t{8:.1f}".format(place,
+                                        parameters['gain'][index],
+                                        parameters['ripple_delay'][index],
+                                        parameters['clog_delay'][index],
+                                        parameters['ramp'][index],
+                                        results['settling'][index],
+                                        results['overshoot'][index],
+                                        results['false_drops'][index],
+                                        results['clogs'][index],
+                                        ))
+
+
+if __name__ == '__main__':
+    main()
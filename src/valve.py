@@ -1,13 +1,7 @@
+import math
 import time
 
-import adafruit_mcp4725
-import busio
-
-try:
-    import board
-except Exception as exc:
-    print("Exception: {}\n".format(exc))
-    BOARD = None
+from .actuator import Actuator
 
 
 class Valve():
@@ -27,6 +21,11 @@ class Valve():
 
     If a DAC is not connected it uses a simulated DAC.
     This allows local testing and simulations.
+
+    All DAC writes go through an Actuator thread,
+     so the control loop never waits on the valve.
+    The Actuator reaches the DAC through a CachedDac,
+     which only goes on the bus for changed values, at a limited rate.
     """
 
     __DELAY = 10
@@ -41,26 +40,59 @@ class Valve():
 
         Sets all initial volts values to calibrated off of 45.
 
-        Requires no external arguments.
-        Contains **kwargs to pass kywd=arg pairs down MRO chain.
+        dac chooses the DAC without asking:
+         'sim' uses SimDac, 'hw' requires the external DAC,
+         'auto' uses the external DAC if connected, else SimDac,
+         any other object is used as the DAC itself.
+        Hardware libraries are only imported to connect the external DAC.
+         Which one was made is kept in dac_choice: 'sim', 'hw',
+         or None for any other object.
+        address is the DAC's I2C address, for several DACs on one bus.
+        If volts is given it is used as initial and optimal volts.
+        dac_rate is the most DAC writes per second, 0 for no limit.
+
+        Uses dac, address, volts and dac_rate in **kwargs if given.
+        Passes kywd=arg pairs down MRO chain.
         """
+        dac = kwargs.pop('dac') if 'dac' in kwargs else None
+        address = kwargs.pop('address') if 'address' in kwargs else 0x62
+        volts = kwargs.pop('volts') if 'volts' in kwargs else 45
+        rate = kwargs.pop('dac_rate') if 'dac_rate' in kwargs else 100
         super().__init__(**kwargs)
 
-        if BOARD:
-            self.__i2c = busio.I2C(board.SCL, board.SDA)
-            self.dac = adafruit_mcp4725.MCP4725(self.__i2c)
-        elif input('Use simulated DAC?\n(Y/N) = ').upper() == 'Y':
-            print()
+        self.address = address
+        self.dac_choice = None
+        if dac == 'sim':
             self.dac = SimDac()
+        elif dac and dac not in ('hw', 'auto'):
+            self.dac = dac
         else:
-            raise Exception("No DAC or unsupported DAC connected.")
-
-        self.volts = self.clog_volts = self.__optimal_volts = 45
-
-        self.__latency = time.time()
+            try:
+                self.dac = connect_dac(address)
+                self.dac_choice = 'hw'
+            except Exception as exc:
+                print("Exception: {}\n".format(exc))
+                if dac == 'hw':
+                    raise Exception("No DAC or unsupported DAC connected.")
+                if (dac != 'auto' and input('Use simulated DAC?\n(Y/N) = ')
+                        .upper() != 'Y'):
+                    raise Exception("No DAC or unsupported DAC connected.")
+                print("Using simulated DAC.\n")
+                self.dac = SimDac()
+
+        if isinstance(self.dac, SimDac):
+            self.dac_choice = 'sim'
+
+        self.volts = self.clog_volts = self.__optimal_volts = \
+            check_bounds(volts)
+
+        self.__latency = self.clock.time()
         self.__time_open = 0
         self.clogged = False
 
+        self.bus = CachedDac(self.dac, rate)
+        self.actuator = Actuator(self.bus, self.clock.sleep, self.profiler)
+
         print(":: VALVE INITIALIZED ::\n")
 
     def set_volts(self, key):
@@ -76,17 +108,24 @@ class Valve():
         vals = {ord('+'): 8, ord('-'): -8}
         funcs = {ord('0'): self.__set_optimal_volts,
                  ord('E'): self.__set_input_volts,
+                 ord('e'): self.__set_input_volts,
                  }
 
-        if (key & 0xDF) in funcs:
+        if key in funcs:
             funcs[key]()
         elif key in vals:
             self.volts += vals[key]
             self.volts = check_bounds(self.volts)
 
-        if (self.dac.raw_value != self.volts and not self.clogged):
+        profiler = self.profiler
+        if profiler:
+            mark = profiler.start()
+        if (self.actuator.target != self.volts and not self.clogged):
             print("Volts: {:.2f}%".format(self.__SCALE * (self.volts - 45)))
-            self.clog_volts = self.dac.raw_value = self.volts
+            self.clog_volts = self.volts
+            self.actuator.set(self.volts)
+        if profiler:
+            profiler.stop('set_volts', mark)
 
     def set_clog_volts(self):
         """Increase clog voltage by 80 (2%) every 5s.
@@ -95,8 +134,8 @@ class Valve():
         Once the output is max for 1min the saturation is a successs
         """
         self.clogged = True
-        if (time.time() - self.__latency > self.__DELAY):
-            self.__latency = time.time()
+        if (self.clock.time() - self.__latency > self.__DELAY):
+            self.__latency = self.clock.time()
             if (self.clog_volts == 4055):
                 self.__time_open += 1
                 print("{}s fuly open.".format(self.__time_open * self.__DELAY))
@@ -109,6 +148,53 @@ class Valve():
             return True
         return False
 
+    def throttle(self, flow, target):
+        """Close valve at once, as flow of [flow] drops/s is over [target].
+
+        Drops per second are taken to grow in line with volts above
+         calibrated off (45), so those are cut by target / flow.
+        Optimal volts are lowered along, so the next drop
+         does not open the valve back up into a stream.
+        """
+        if flow <= target:
+            return
+        self.volts = check_bounds(45 + (self.volts - 45) * target / flow)
+        self.__optimal_volts = min(self.__optimal_volts, self.volts)
+        self.__time_open = 0
+        self.clogged = False
+        self.clog_volts = self.volts
+
+        print("Throttled, Volts: {:.2f}%".format(
+              self.__SCALE * (self.volts - 45)))
+        self.actuator.set(self.volts)
+
+    def get_valve_state(self):
+        """Return voltages and clog state (dict)."""
+        return {'volts': self.volts,
+                'clog_volts': self.clog_volts,
+                'optimal_volts': self.__optimal_volts,
+                'time_open': self.__time_open,
+                'clogged': self.clogged,
+                }
+
+    def set_valve_state(self, state):
+        """Carry on from state returned by get_valve_state().
+
+        The valve is sent to its restored voltage.
+        Clog volts are next raised __DELAY seconds from now.
+        """
+        self.volts = state['volts'].item()
+        self.clog_volts = state['clog_volts'].item()
+        self.__optimal_volts = state['optimal_volts'].item()
+        self.__time_open = int(state['time_open'])
+        self.__latency = self.clock.time()
+        self.clogged = bool(state['clogged'])
+        self.actuator.set(self.clog_volts if self.clogged else self.volts)
+
+    def get_optimal_volts(self):
+        """Return volts drops are calculated around."""
+        return self.__optimal_volts
+
     def __set_optimal_volts(self):
         """Set optimal volt value according to researcher.
 
@@ -125,46 +211,41 @@ class Valve():
         except ValueError:
             print("Input was not a number")
 
-    def calculate(self, k, seconds_per_drops, last_drop_time):
-        """Calculate appropriate voltage based on most recent drop."""
+    def calculate(self, k, seconds_per_drops, last_drop_time, stamp=None,
+                  drop_time=None):
+        """Calculate appropriate voltage based on most recent drop.
+
+        stamp: time.monotonic() the drop's frame was captured at,
+         passed on to the actuator with the new voltage.
+        drop_time: clock time the drop was seen at, by default now.
+        """
         print("Calculating new voltage...")
-        delta = (time.time() - last_drop_time) - seconds_per_drops
+        now = self.clock.time() if drop_time is None else drop_time
+        delta = (now - last_drop_time) - seconds_per_drops
         self.volts = check_bounds((self.__optimal_volts + delta * k))
 
-        if (self.dac.raw_value != self.volts):
+        profiler = self.profiler
+        if profiler:
+            mark = profiler.start()
+        if (self.actuator.target != self.volts):
             print("Volts: {:.2f}%".format(self.__SCALE * (self.volts - 45)))
-            self.clog_volts = self.dac.raw_value = self.volts
+            self.clog_volts = self.volts
+            self.actuator.set(self.volts, stamp)
+        if profiler:
+            profiler.stop('calculate', mark)
 
     def equalize(self):
         """Reset current volts to last known volts before clogging.
 
         Closes valve 2x as fast as clog protocol opens it.
+        The ramp is left to the actuator, returns immediately.
         """
         self.__time_open = 0
         self.clogged = False
 
-        while(self.clog_volts > self.volts):
-            self.clog_volts -= 80
-            time.sleep(0.05)
-
-        if (self.clog_volts < self.volts):
-            self.clog_volts = self.volts
-
-
-def shutoff_valve(dac):
-    """Completely close the valve.
-
-    Makes the current volts a multiple of 10. Then decreases by 5.
-    Continues until the volts set to 44% the calibrated 'closed' volts.
-    TODO: Parallelize
-    TODO: Test read capability of self.dac.raw_value
-    """
-    print("Shutting off valve...")
-    dac.raw_value = int(dac.raw_value / 10) * 10
-    while (dac.raw_value > 20):
-        dac.raw_value -= 5
-        time.sleep(0.1)
-    print("Valve closed.\n")
+        if (self.clog_volts > self.volts):
+            self.actuator.ramp(self.volts, 80, 0.05)
+        self.clog_volts = self.volts
 
 
 def check_bounds(volts):
@@ -180,14 +261,101 @@ def check_bounds(volts):
     return volts
 
 
+def connect_dac(address):
+    """Connect to the MCP4725 at I2C [address] on the board's I2C bus.
+
+    Its libraries are imported here, so nothing else waits on them.
+
+    Returns: adafruit_mcp4725.MCP4725
+    """
+    import adafruit_mcp4725
+    import board
+    import busio
+
+    return adafruit_mcp4725.MCP4725(busio.I2C(board.SCL, board.SDA),
+                                    address=address)
+
+
+class CachedDac():
+    """Cached, Rate Limited DAC Access.
+
+    Stands in for a DAC, keeping the last value committed to it.
+    Reading raw_value returns that value without touching the bus.
+    Writing rounds to a whole DAC count, skips values already there,
+     and waits until at least 1/[rate] seconds passed since the last
+     write. The wait is meant for the Actuator thread.
+
+    Bus operations are counted in reads and writes,
+     writes left out because nothing changed in skipped.
+    """
+
+    def __init__(self, dac, rate=100):
+        """Wrap [dac], reading its current value once."""
+        self.dac = dac
+        self.interval = 1 / rate if rate else 0
+        self.reads = 1
+        self.writes = 0
+        self.skipped = 0
+        self.__value = dac.raw_value
+        self.__written = -math.inf
+
+    @property
+    def raw_value(self):
+        """Return last committed value."""
+        return self.__value
+
+    @raw_value.setter
+    def raw_value(self, value):
+        """Commit [value] to the DAC if it differs from the last one."""
+        value = int(round(value))
+        if value == self.__value:
+            self.skipped += 1
+            return
+
+        self.wait()
+        self.dac.raw_value = value
+        self.__value = value
+        self.__written = time.monotonic()
+        self.writes += 1
+
+    def wait(self):
+        """Sleep until another write is allowed."""
+        remaining = self.__written + self.interval - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+
+
 class SimDac():
     """Simulated Digital to Analog Converter.
 
     Solely for testing and simulation purposes
 
+    Each read or write of raw_value takes [latency] seconds,
+     roughly an MCP4725 transaction on a 100kHz I2C bus,
+     and is counted in reads and writes.
+
     TODO: Implement further DAC methods
     """
 
-    def __init__(self):
+    def __init__(self, latency=0.0005):
         """Create self.raw_value for calling by other methods."""
-        self.raw_value = 0
+        self.latency = latency
+        self.reads = 0
+        self.writes = 0
+        self.__value = 0
+
+    @property
+    def raw_value(self):
+        """Return value after a simulated bus read."""
+        self.reads += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self.__value
+
+    @raw_value.setter
+    def raw_value(self, value):
+        """Set value after a simulated bus write."""
+        self.writes += 1
+        if self.latency:
+            time.sleep(self.latency)
+        self.__value = value
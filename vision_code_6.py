@@ -1,6 +1,9 @@
-from src.experiment import Experiment
+import time
+
+STARTED = time.monotonic()
+
+from src.launch import main  # noqa: E402
 
 
 if __name__ == '__main__':
-    Experiment("ASS_v5").main()
-    
\ No newline at end of file
+    main(STARTED)